@@ -1,13 +1,23 @@
 import os
 import boto3
-import paramiko
 import mysql.connector
 import yaml
-import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from loguru import logger
 
+from sshConnectionPool import SSHConnectionPool
+from metricsRegistry import MetricsRegistry
+from componentWriter import ComponentWriter
+
+# Columns of a servers row loaded for reconciliation, after server_ip
+SERVER_COLUMNS = ('os', 'user', 'search_path', 'region', 'running_state', 'server_name', 'update_status', 'error_message')
+
+# One round trip per host: os-release is already KEY=value lines, the /apps check is appended as one more
+PROBE_COMMAND = "cat /etc/os-release 2>/dev/null; echo; test -d /apps && echo APPS_DIR=exists || echo APPS_DIR=missing"
+
 class ServerDetailsManager:
-    def __init__(self, config_file, script_directory):
+    def __init__(self, config_file, script_directory, ssh_pool=None, metrics=None, connect=None):
                 # Load configuration from YAML file
         with open(config_file, 'r') as file:
             self.config = yaml.safe_load(file)
@@ -15,12 +25,24 @@ class ServerDetailsManager:
         # AWS Regions and Datacenter configurations
         self.regions = self.config['aws']['regions']
         self.datacenters = self.config['datacenters']
+        self.failed_regions = set()
+
+        # Concurrent SSH probing of new and failed hosts
+        discovery_config = self.config.get('discovery') or {}
+        self.probe_workers = max(1, int(discovery_config.get('probe_workers', 32)))
+        self.probe_timeout = discovery_config.get('probe_timeout', 60)
         
         # Database connection setup
         self.db_config = self.config['db_config']
-        self.db_connection = mysql.connector.connect(**self.db_config)
+        self.db_connection = (connect or mysql.connector.connect)(**self.db_config)
         self.cursor = self.db_connection.cursor()
 
+        # SSH connections can be shared with ComponentFetcher when both run in one process
+        self.os_users = {'amazon-linux': 'ec2-user', 'centos': 'centos', 'rocky': 'rocky'}
+        self.owns_ssh_pool = ssh_pool is None
+        self.ssh_pool = ssh_pool or SSHConnectionPool(connect_timeout=10)
+        self.metrics = metrics or MetricsRegistry()
+
         # Set up logging
         log_file_path = os.path.join(script_directory, './logs/server_details_manager_{time:YYYYMMDDHHmmss}.log')
         logger.add(
@@ -30,25 +52,51 @@ class ServerDetailsManager:
             format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <7} | {message}"
         )
 
+    def get_region_servers(self, region, region_data):
+        # Terminated instances are filtered out by EC2 and only the fields we store are
+        # kept from each page. The Team exclusion stays here, as Filters can only include
+        with self.metrics.time('discovery', region):
+            ec2 = boto3.session.Session().client('ec2', region_name=region)  # clients are not shared between threads
+            pages = ec2.get_paginator('describe_instances').paginate(
+                Filters=[{'Name': 'instance-state-name', 'Values': ['pending', 'running', 'stopping', 'stopped']}],
+                PaginationConfig={'PageSize': 1000}
+            )
+            instances = list(pages.search('Reservations[].Instances[].{ip: PrivateIpAddress, state: State.Name, tags: Tags}'))
+
+        servers = []
+        for instance in instances:
+            tags = {tag['Key']: tag['Value'] for tag in instance['tags'] or []}
+            team_tag = tags.get('Team')
+            if instance['ip'] and (team_tag is None or team_tag.lower() != "tradeops"):
+                servers.append({
+                    'ip': instance['ip'],
+                    'region': region,
+                    'key_path': region_data["key_path"],
+                    'running_state': instance['state'],
+                    'server_name': tags.get('Name'),
+                })
+        return servers
+
     def get_all_servers(self):
         servers = []
+        self.failed_regions = set()
 
-        # Fetch AWS servers only if regions are defined
+        # Fetch AWS servers only if regions are defined, all regions at once
         if self.regions:
-            for region, region_data in self.regions.items():
-                ec2 = boto3.resource('ec2', region_name=region)
-                instances = ec2.instances.all()  # Get all instances
-                for instance in instances:
-                    team_tag = next((tag['Value'] for tag in instance.tags if tag['Key'] == 'Team'), None)
-                    if team_tag is None or team_tag.lower() != "tradeops":
-                        server_name = next((tag['Value'] for tag in instance.tags if tag['Key'] == 'Name'), None)
-                        servers.append({
-                            'ip': instance.private_ip_address,
-                            'region': region,
-                            'key_path': region_data["key_path"],
-                            'running_state': instance.state['Name'],
-                            'server_name': server_name,
-                        })
+            with ThreadPoolExecutor(max_workers=min(len(self.regions), 16), thread_name_prefix='ec2-discovery') as executor:
+                futures = {
+                    region: executor.submit(self.get_region_servers, region, region_data)
+                    for region, region_data in self.regions.items()
+                }
+                for region, future in futures.items():
+                    try:
+                        region_servers = future.result()
+                    except Exception as e:
+                        logger.error(f"Failed to list instances in region {region}: {e}")
+                        self.failed_regions.add(region)
+                        continue
+                    logger.info(f"Found {len(region_servers)} instances in region {region}.")
+                    servers.extend(region_servers)
         
         # Fetch TCN and LDC servers from config
         if self.datacenters:
@@ -66,143 +114,237 @@ class ServerDetailsManager:
         return servers
 
 
-    def check_os_type(self, ssh_client):
-        try:
-            stdin, stdout, stderr = ssh_client.exec_command("cat /etc/os-release")
-            os_info = stdout.read().decode('utf-8')
-            if "Amazon Linux" in os_info:
-                return "amazon-linux"
-            elif "CentOS" in os_info:
-                return "centos"
-            return None
-        except Exception as e:
-            logger.error(f"Error while checking OS type: {e}")
-            return None
+    def parse_probe_output(self, output):
+        # KEY=value lines into a dict, with quotes around os-release values removed
+        fields = {}
+        for line in output.splitlines():
+            key, separator, value = line.partition('=')
+            if separator:
+                fields[key.strip()] = value.strip().strip('"\'')
+        return fields
 
-    def attempt_connection(self, ip, user, key_path):
-        ssh_client = paramiko.SSHClient()
-        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
-        try:
-            ssh_client.connect(hostname=ip, username=user, key_filename=key_path, timeout=10)
+    def check_os_type(self, fields):
+        os_name = fields.get('NAME', '')
+        if "Amazon Linux" in os_name:
+            return "amazon-linux"
+        elif "CentOS" in os_name:
+            return "centos"
+        elif "Rocky Linux" in os_name:
+            return "rocky"
+        return None
+
+    def attempt_connection(self, ip, users, key_path, preferred_user=None):
+        ssh_client, user = self.ssh_pool.acquire_any(ip, users, key_path, preferred_user)
+        if ssh_client:
             logger.info(f"Successfully connected to {ip} as {user}.")
-            return ssh_client
-        except Exception as e:
-            logger.warning(f"Connection with {user} failed on {ip}: {e}")
+        return ssh_client, user
+
+    def load_servers(self):
+        # The whole servers table, keyed by IP, to be diffed against the discovered inventory
+        self.cursor.execute(
+            "SELECT server_ip, os, user, search_path, region, running_state, server_name, update_status, error_message FROM servers"
+        )
+        return {row[0]: dict(zip(SERVER_COLUMNS, row[1:])) for row in self.cursor.fetchall()}
+
+    def known_user(self, stored):
+        # The stored user, or failing that the default login of the stored OS type
+        if not stored:
             return None
+        return stored['user'] or self.os_users.get(stored['os'])
+
+    def probe_server(self, server, stored):
+        # Returns os, user, search_path, update_status and error_message for the host
+        ip = server['ip']
+        key_path = server['key_path']
+        if server['running_state'] != 'running':
+            # If server is not running, we don't attempt to connect
+            logger.info(f"Server {ip} is not running. Skipping OS type check and search path determination.")
+            return None, None, None, 'Failure', f"Server {ip} is not running."
 
-    def get_user_from_db(self, ip):
+        # A user already known for this host is tried first, then all defaults at once
+        default_user = server.get('user', 'ec2-user')  # Default to 'ec2-user' for AWS instances
+        with self.metrics.time('ssh_connect', server['region']):
+            ssh_client, user = self.attempt_connection(ip, [default_user, 'centos', 'rocky'], key_path, self.known_user(stored))
+        if not ssh_client:
+            return None, None, None, 'Failure', f"Failed to connect to {ip} with users : [ec2-user, centos, rocky]"
         try:
-            self.cursor.execute("SELECT user FROM servers WHERE server_ip = %s", (ip,))
-            result = self.cursor.fetchone()
-            return result[0] if result else None
-        except mysql.connector.Error as e:
-            logger.error(f"Error while retrieving user from DB for IP {ip}: {e}")
-            return None
+            # OS type and whether /apps exists, from a single command
+            with self.metrics.time('probe_exec', server['region']):
+                stdin, stdout, stderr = ssh_client.exec_command(PROBE_COMMAND, timeout=self.probe_timeout)
+                fields = self.parse_probe_output(stdout.read().decode('utf-8', 'replace'))
+            if 'APPS_DIR' not in fields:
+                raise RuntimeError("probe command returned no result")
+            os_type = self.check_os_type(fields)
+            search_path = "/apps" if fields['APPS_DIR'] == 'exists' else "/home/directfn/app"
+            logger.info(f"Connected to {ip} with {user}. OS: {os_type}, search path: {search_path}")
+            return os_type, user, search_path, 'Success', None
+        except Exception as e:
+            logger.error(f"Failed to execute commands on {ip}: {e}")
+            return None, user, None, 'Failure', f"Failed to execute commands on {ip}: {e}"
+        finally:
+            # Kept open in the pool for the fetcher when it runs in the same process
+            self.ssh_pool.release(ip, user, key_path)
 
-    def server_exists_in_db(self, ip):
+    def probe_servers(self, probes):
+        # Probes (server, stored row) pairs on a pool of probe_workers threads. A host
+        # still running probe_timeout seconds after its probe started is recorded as
+        # failed and left to finish in the background
+        results = {}
+        if not probes:
+            return results
+        started = {}
+        reported = 0
+        outcomes = dict.fromkeys(('connected', 'failed', 'timed out'), 0)
+        begin = time.monotonic()
+
+        def probe(server, stored):
+            started[server['ip']] = time.monotonic()
+            return self.probe_server(server, stored)
+
+        executor = ThreadPoolExecutor(max_workers=self.probe_workers, thread_name_prefix='ssh-probe')
+        in_flight = {executor.submit(probe, server, stored): server['ip'] for server, stored in probes}
         try:
-            self.cursor.execute("SELECT 1 FROM servers WHERE server_ip = %s and update_status = %s", (ip,'Success',))
-            exists = self.cursor.fetchone() is not None
-            return exists
-        except mysql.connector.Error as e:
-            logger.error(f"Error while checking if server exists in DB for IP {ip}: {e}")
-            return False
+            while in_flight:
+                done, _ = wait(in_flight, timeout=1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    ip = in_flight.pop(future)
+                    try:
+                        results[ip] = future.result()
+                    except Exception as e:
+                        logger.error(f"Probe of {ip} failed: {e}")
+                        results[ip] = (None, None, None, 'Failure', f"Probe of {ip} failed: {e}")
+                    outcomes['connected' if results[ip][3] == 'Success' else 'failed'] += 1
 
-    def update_servers_table(self):
+                now = time.monotonic()
+                for future, ip in list(in_flight.items()):
+                    if ip in started and now - started[ip] > self.probe_timeout:
+                        del in_flight[future]
+                        logger.warning(f"Probe of {ip} exceeded {self.probe_timeout}s, recording it as failed.")
+                        results[ip] = (None, None, None, 'Failure', f"Probe of {ip} timed out after {self.probe_timeout}s")
+                        outcomes['timed out'] += 1
+
+                if len(results) - reported >= 50 or (results and not in_flight):
+                    reported = len(results)
+                    logger.info(f"Probed {len(results)}/{len(probes)} hosts ({outcomes['failed'] + outcomes['timed out']} failed).")
+        finally:
+            executor.shutdown(wait=False)
 
+        logger.info(
+            f"Probed {len(probes)} hosts in {time.monotonic() - begin:.1f}s: {outcomes['connected']} connected, "
+            f"{outcomes['failed']} failed, {outcomes['timed out']} timed out."
+        )
+        return results
+
+    def update_servers_table(self):
+        # Diffs the discovered inventory against the servers table read once, probes only
+        # new and previously failed hosts, and writes every change in one transaction
         servers = self.get_all_servers()  # Get all servers, both running and not running
 
-        # Sort servers by IP address
+        # Sort servers by IP address; an IP listed twice keeps its first entry
         servers.sort(key=lambda server: server['ip'])
-
+        discovered = {}
         for server in servers:
-            ip = server['ip']
-            region = server['region']
-            key_path = server['key_path']
-            running_state = server['running_state']
-            server_name = server['server_name']
-
-            # Default values for update status and error message
-            update_status = 'Success'
-            error_message = None
-
-            # Get the current timestamp for last update time
-            last_updated_time = datetime.datetime.now()
-
-            # Skip if server already exists in the database
-            if self.server_exists_in_db(ip):
-                logger.info(f"Skipping server {ip} as it already exists in the database.")
-                continue  # Skip to the next server
-            
-            os_type = None
-            search_path = None
-
-            # For stopped servers, no need to check OS type or attempt connection
-            if running_state == 'running':
-                # Check if user is already in the database
-                user = self.get_user_from_db(ip)
-
-                if user is None:
-                    # If user is not in the database, default to ec2-user or centos
-                    user = server.get('user', 'ec2-user')  # Default to 'ec2-user' for AWS instances
-                ssh_client = self.attempt_connection(ip, user, key_path)
-                if ssh_client is None:
-                    user = 'centos'  # Second try
-                    ssh_client = self.attempt_connection(ip, user, key_path)
-                    if ssh_client is None:
-                        user = 'rocky'  # Third try
-                        ssh_client = self.attempt_connection(ip, user, key_path)
-                if ssh_client:
-                    try:
-                        os_type = self.check_os_type(ssh_client)
-                        logger.info(f"Connected to {ip} with {user}. OS: {os_type}")
+            discovered.setdefault(server['ip'], server)
 
-                        # Check if /apps directory exists
-                        stdin, stdout, stderr = ssh_client.exec_command("test -d /apps && echo 'exists' || echo 'not exists'")
-                        search_path = "/apps" if stdout.read().decode().strip() == 'exists' else "/home/directfn/app"
-                        logger.info(f"Using search path: {search_path}")
+        stored_servers = self.load_servers()
+        counts = dict.fromkeys(('added', 'changed', 'removed', 'unchanged'), 0)
+        probed_rows, moved_rows, removed_rows = [], [], []
 
-                    except Exception as e:
-                        logger.error(f"Failed to execute commands on {ip}: {e}")
-                        update_status = 'Failure'
-                        error_message = f"Failed to execute commands on {ip}: {e}"
-                        search_path = None  # Set search_path to None if command execution fails
-                    finally:
-                        ssh_client.close()
+        # Hosts already set up are not probed again, nor are hosts the fetcher parked after
+        # repeated failures; only their EC2 details are kept current
+        probes = [
+            (server, stored_servers.get(ip)) for ip, server in discovered.items()
+            if ip not in stored_servers or stored_servers[ip]['update_status'] not in ('Success', 'Parked')
+        ]
+        probe_results = self.probe_servers(probes)
+
+        for ip, server in discovered.items():
+            stored = stored_servers.get(ip)
+            details = (server['region'], server['running_state'], server['server_name'])
+
+            if ip not in probe_results:
+                if details == (stored['region'], stored['running_state'], stored['server_name']):
+                    counts['unchanged'] += 1
                 else:
-                    user = None
-                    search_path = None  # No SSH connection if failed to connect
-                    update_status = 'Failure'
-                    error_message = f"Failed to connect to {ip} with users : [ec2-user, centos, rocky]"
-            else:
-                # If server is not running, we don't attempt to connect
-                logger.info(f"Server {ip} is not running. Skipping OS type check and search path determination.")
-                search_path = None
-                update_status = 'Failure'
-                error_message = f"Server {ip} is not running."
-
-            # Insert or update server details into the servers table
-            try:
-                self.cursor.execute(
+                    counts['changed'] += 1
+                    moved_rows.append(details + (ip,))
+                continue
+
+            os_type, user, search_path, update_status, error_message = probe_results[ip]
+            row = (ip, os_type, user, search_path) + details + (update_status, error_message)
+            probed_rows.append(row)
+            if stored is None:
+                counts['added'] += 1
+                continue
+            merged = (os_type or stored['os'], user or stored['user'], search_path) + details + (update_status, error_message)
+            counts['unchanged' if merged == tuple(stored[column] for column in SERVER_COLUMNS) else 'changed'] += 1
+
+        # Hosts gone from a region that was listed successfully were terminated
+        listed_regions = (set(self.regions or ()) - self.failed_regions) | set(self.datacenters or ())
+        for ip, stored in stored_servers.items():
+            if ip not in discovered and stored['region'] in listed_regions and stored['running_state'] != 'terminated':
+                counts['removed'] += 1
+                removed_rows.append((f"Server {ip} is no longer in the inventory.", ip))
+
+        write_started = time.perf_counter()
+        try:
+            if probed_rows:
+                self.cursor.executemany(
                     """
                     INSERT INTO servers (server_ip, os, user, search_path, region, running_state, server_name, last_updated_time, update_status, error_message) 
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) 
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), %s, %s) 
                     ON DUPLICATE KEY UPDATE 
-                        os=%s, user=%s, search_path=%s, region=%s, running_state=%s, server_name=%s, last_updated_time=%s, update_status=%s, error_message=%s
+                        os=COALESCE(VALUES(os), os), user=COALESCE(VALUES(user), user), search_path=VALUES(search_path), region=VALUES(region),
+                        running_state=VALUES(running_state), server_name=VALUES(server_name), last_updated_time=VALUES(last_updated_time),
+                        update_status=VALUES(update_status), error_message=VALUES(error_message)
                     """,
-                    (
-                        ip, os_type, user, search_path, region, running_state, server_name, last_updated_time, update_status, error_message,
-                        os_type, user, search_path, region, running_state, server_name, last_updated_time, update_status, error_message
-                    )
+                    probed_rows
                 )
-                self.db_connection.commit()
-                logger.info(f"Server {ip} details updated successfully.")
-            except mysql.connector.Error as e:
-                logger.error(f"Error while inserting/updating server {ip}: {e}")
-                self.db_connection.rollback()
+            if moved_rows:
+                self.cursor.executemany(
+                    "UPDATE servers SET region = %s, running_state = %s, server_name = %s WHERE server_ip = %s",
+                    moved_rows
+                )
+            if removed_rows:
+                self.cursor.executemany(
+                    "UPDATE servers SET running_state = 'terminated', scan_token = NULL, last_updated_time = NOW(), update_status = 'Failure', error_message = %s WHERE server_ip = %s",
+                    removed_rows
+                )
+                self.remove_components([ip for _, ip in removed_rows])
+            self.db_connection.commit()
+            self.metrics.observe('servers_write', time.perf_counter() - write_started)
+        except mysql.connector.Error as e:
+            logger.error(f"Error while writing the servers table, no changes were saved: {e}")
+            self.db_connection.rollback()
+            raise
+
+        for change, change_count in counts.items():
+            self.metrics.count('servers_reconciled', change_count, change=change)
+        logger.info(
+            f"Servers table updated: {counts['added']} added, {counts['changed']} changed, "
+            f"{counts['removed']} removed, {counts['unchanged']} unchanged."
+        )
+        return counts
+
+    def remove_components(self, ips):
+        # Terminated hosts' components are deleted in the open transaction that marks them,
+        # through ComponentWriter so the rollup tables lose them too
+        removed = []
+        for start in range(0, len(ips), 500):
+            chunk = ips[start:start + 500]
+            self.cursor.execute(
+                f"SELECT host_id, ip, region FROM hosts WHERE component_count > 0 AND ip IN ({', '.join(['%s'] * len(chunk))})",
+                tuple(chunk)
+            )
+            removed.extend(self.cursor.fetchall())
+        for host_id, ip, region in removed:
+            ComponentWriter(None, ip, region, None, connection=self.db_connection, host_id=host_id).remove()
+        if removed:
+            logger.info(f"Removed the components of {len(removed)} terminated hosts.")
 
     def close(self):
+        if self.owns_ssh_pool:
+            self.ssh_pool.close()
         try:
             self.db_connection.close()
             logger.info("Database connection closed.")
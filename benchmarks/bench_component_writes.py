@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from componentFetcher import ComponentFetcher
+
+BENCH_IP = '198.51.100.200'  # TEST-NET address, never a real server
+BENCH_REGION = 'benchmark'
+
+def make_components(count):
+    return [
+        {'comp_name': f"bench-component-{i}", 'platform': 'Java' if i % 3 else 'C++', 'path': f"/apps/bench-component-{i}"}
+        for i in range(count)
+    ]
+
+def legacy_write(db_pool, ip, region, components):
+    # The pre-batching write path: DELETE, then SELECT + INSERT + COMMIT for every component,
+    # into the wide table the normalized layout replaced (kept as components_legacy)
+    with db_pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM components_legacy WHERE ip = %s AND region = %s", (ip, region))
+        for component in components:
+            cursor.execute(
+                "SELECT 1 FROM components_legacy WHERE ip = %s AND component_name = %s AND region = %s",
+                (ip, component['comp_name'], region)
+            )
+            if cursor.fetchone() is None:
+                cursor.execute(
+                    "INSERT INTO components_legacy (ip, region, component_name, platform, comp_path) VALUES (%s, %s, %s, %s, %s)",
+                    (ip, region, component['comp_name'], component['platform'], component['path'])
+                )
+                connection.commit()
+        cursor.close()
+
+def measure(label, write, rounds, row_count):
+    elapsed = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        write()
+        elapsed.append(time.perf_counter() - start)
+    best = min(elapsed)
+    print(f"{label:<10} best {best * 1000:8.1f} ms   {row_count / best:10.0f} rows/sec")
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-row and batched component writes for one host.")
+    parser.add_argument('--config', default='./config/config.yaml', help='Path to the YAML configuration file')
+    parser.add_argument('--components', type=int, default=200, help='Components on the simulated host')
+    parser.add_argument('--rounds', type=int, default=5, help='Repetitions per write strategy')
+    args = parser.parse_args()
+
+    fetcher = ComponentFetcher(args.config)
+    components = make_components(args.components)
+    try:
+        before = measure('before', lambda: legacy_write(fetcher.db_pool, BENCH_IP, BENCH_REGION, components), args.rounds, len(components))
+        after = measure('after', lambda: fetcher.replace_components(BENCH_IP, BENCH_REGION, components), args.rounds, len(components))
+        print(f"speedup    {before / after:.1f}x")
+    finally:
+        with fetcher.db_pool.transaction() as cursor:
+            cursor.execute("DELETE FROM components_legacy WHERE ip = %s AND region = %s", (BENCH_IP, BENCH_REGION))
+            cursor.execute(
+                "DELETE FROM host_components WHERE host_id IN (SELECT host_id FROM hosts WHERE ip = %s AND region = %s)",
+                (BENCH_IP, BENCH_REGION)
+            )
+        fetcher.close()
+
+if __name__ == "__main__":
+    main()
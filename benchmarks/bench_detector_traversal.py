@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import componentDetector
+from componentDetector import ComponentDetector
+from synthetic_tree import generate_tree
+
+class LegacyDetector(ComponentDetector):
+    # The listdir + isdir traversal the detector used before the single-pass scan
+    def legacy_identify(self, dir_path):
+        comp_name = os.path.basename(dir_path)
+        platform = self.get_platform(comp_name)
+        if os.path.isdir(dir_path) and platform:
+            return {"comp_name": comp_name, "platform": platform, "path": dir_path}
+        for file in os.listdir(dir_path):
+            platform = self.classify_files([file])
+            if platform:
+                return {"comp_name": comp_name, "platform": platform, "path": dir_path}
+        for sub_dir in ['bin', 'lib']:
+            sub_dir_path = os.path.join(dir_path, sub_dir)
+            if os.path.isdir(sub_dir_path):
+                for file in os.listdir(sub_dir_path):
+                    platform = self.classify_files([file])
+                    if platform:
+                        return {"comp_name": comp_name, "platform": platform, "path": dir_path}
+        return None
+
+    def legacy_directories(self, current_dir):
+        return [
+            os.path.join(current_dir, directory) for directory in os.listdir(current_dir)
+            if os.path.isdir(os.path.join(current_dir, directory)) and not self.is_excluded_directory(directory)
+        ]
+
+    def legacy_traverse(self, dir_path, depth):
+        if depth > self.max_depth:
+            return
+        for subdir_path in self.legacy_directories(dir_path):
+            component = self.legacy_identify(subdir_path)
+            if component:
+                self.components.append(component)
+            else:
+                self.legacy_traverse(subdir_path, depth + 1)
+
+    def gather_components(self):
+        self.legacy_traverse(self.base_dir, 1)
+        self.status = "success"
+
+class SyscallCounter:
+    # Counts the filesystem calls made through the os module; DirEntry.is_dir() answers
+    # from the directory listing and costs no call of its own
+    def __init__(self):
+        self.counts = Counter()
+        self.originals = {}
+
+    def wrap(self, module, name):
+        original = getattr(module, name)
+        self.originals[(module, name)] = original
+
+        def counted(*args, **kwargs):
+            self.counts[name] += 1
+            return original(*args, **kwargs)
+        setattr(module, name, counted)
+
+    def __enter__(self):
+        self.wrap(os, 'listdir')
+        self.wrap(os, 'stat')
+        if componentDetector.scandir is not None:
+            self.wrap(componentDetector, 'scandir')
+        return self
+
+    def __exit__(self, *exc_info):
+        for (module, name), original in self.originals.items():
+            setattr(module, name, original)
+
+def run(label, detector):
+    with SyscallCounter() as counter:
+        start = time.perf_counter()
+        detector.gather_components()
+        elapsed = time.perf_counter() - start
+    total = sum(counter.counts.values())
+    print(f"{label:<8} {elapsed:7.2f} s   {total:8d} calls  {dict(counter.counts)}   {len(detector.components)} components")
+    return sorted(component['path'] for component in detector.components)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare legacy and single-pass detector traversal on a synthetic tree.")
+    parser.add_argument('--directories', type=int, default=50000, help='Directories in the synthetic tree')
+    parser.add_argument('--root', default=None, help='Reuse or create the synthetic tree here instead of a temp dir')
+    args = parser.parse_args()
+
+    root = args.root or tempfile.mkdtemp(prefix='component-tree-')
+    try:
+        if not os.path.isdir(root) or not os.listdir(root):
+            print(f"Generating {args.directories} directories under {root} ...")
+            generate_tree(root, args.directories)
+        legacy = run('before', LegacyDetector(root))
+        current = run('after', ComponentDetector(root))
+        if legacy != current:
+            print("WARNING: legacy and single-pass traversal found different components")
+    finally:
+        if not args.root:
+            shutil.rmtree(root)
+
+if __name__ == "__main__":
+    main()
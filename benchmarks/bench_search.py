@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from componentIndex import ComponentIndex
+
+REGIONS = ['us-east-1', 'us-west-2', 'eu-west-1', 'ap-southeast-1', 'dc1', 'dc2']
+PLATFORMS = ['Java', 'C++', 'opa']
+QUERIES = [
+    'order', 'feed', 'app', '10.', '10.3.', 'svc-17', 'gateway*', 'platform:Java region:eu-west-1',
+    '10.1.0.0/16', 'name:risk* platform:C++', 'path:/apps/price', 'nothing-matches-this',
+]
+
+def synthetic_rows(row_count, host_count=2000, name_count=400, seed=7):
+    # A components table shaped like ours: a few hundred names repeated across hosts
+    rng = random.Random(seed)
+    stems = ['order', 'feed', 'price', 'risk', 'gateway', 'auth', 'report', 'svc', 'app', 'cache']
+    names = [f"{rng.choice(stems)}-{kind}-{i}" for i, kind in enumerate(rng.choice(['svc', 'handler', 'engine']) for _ in range(name_count))]
+    hosts = [(rng.choice(REGIONS), f"10.{rng.randrange(8)}.{rng.randrange(256)}.{rng.randrange(1, 255)}") for _ in range(host_count)]
+    for i in range(row_count):
+        region, ip = hosts[i % host_count]
+        name = names[rng.randrange(name_count)]
+        yield (region, ip, name, rng.choice(PLATFORMS), f"/apps/{name}")
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def report(label, samples):
+    print(f"{label:<34} p50 {percentile(samples, 0.5) * 1000:9.2f} ms   p99 {percentile(samples, 0.99) * 1000:9.2f} ms")
+
+def full_scan(rows, value):
+    # What component_name LIKE '%x%' OR ip LIKE '%x%' has to do: look at every row
+    value = value.lower()
+    return sorted((row for row in rows if value in row[2].lower() or value in row[1].lower()), key=lambda row: row[:3])
+
+def main():
+    parser = argparse.ArgumentParser(description="Query latency of the in-memory component index.")
+    parser.add_argument('--rows', type=int, default=1000000, help='Rows in the synthetic components table')
+    parser.add_argument('--repeat', type=int, default=20, help='Times each query is run')
+    args = parser.parse_args()
+
+    rows = list(synthetic_rows(args.rows))
+    start = time.perf_counter()
+    index = ComponentIndex()
+    index.add_rows(rows)
+    index.prepare()
+    print(f"Indexed {len(index)} rows in {time.perf_counter() - start:.1f} s")
+
+    all_samples = []
+    for query in QUERIES:
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results = index.search(query)
+            samples.append(time.perf_counter() - start)
+        all_samples.extend(samples)
+        report(f"{query!r} ({len(results)} rows)", samples)
+    report('all queries (index)', all_samples)
+
+    page_samples = []
+    for query in QUERIES:
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            index.search_page(query, 100)
+            page_samples.append(time.perf_counter() - start)
+    report('first page of 100 (index)', page_samples)
+
+    scan_samples = []
+    for query in ['order', 'svc-17', 'nothing-matches-this']:
+        start = time.perf_counter()
+        full_scan(rows, query)
+        scan_samples.append(time.perf_counter() - start)
+    report('full scan baseline', scan_samples)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+
+import yaml
+from loguru import logger
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from componentFetcher import ComponentFetcher
+from componentSearcher import RemoteDatabaseSearcher
+from metricsRegistry import MetricsRegistry
+from synthetic_tree import generate_tree
+from bench_search import QUERIES, percentile
+from fake_fleet import FakeFleet, FakeSSHConnectionPool, create_database, sqlite_connect
+
+REGIONS = ['bench-dc1', 'bench-dc2', 'bench-dc3']
+
+def build_fleet(root, hosts, trees, directories):
+    # Hosts share a few synthetic /apps trees; each keeps its own detector cache
+    tree_paths = []
+    for tree in range(trees):
+        path = os.path.join(root, 'trees', f"apps-{tree}")
+        if not os.path.isdir(path):
+            generate_tree(path, directories, seed=tree)
+        tree_paths.append(path)
+
+    servers = [
+        (f"10.200.{i // 250}.{i % 250 + 1}", 'bench', tree_paths[i % trees], REGIONS[i % len(REGIONS)])
+        for i in range(hosts)
+    ]
+    database = os.path.join(root, 'inventory.db')
+    if os.path.exists(database):
+        os.remove(database)
+    create_database(database, servers)
+
+    config = {
+        'aws': {'regions': {}},
+        'datacenters': {
+            region: {'ips': [ip for ip, _, _, server_region in servers if server_region == region], 'key_path': 'bench.pem', 'user': 'bench'}
+            for region in REGIONS
+        },
+        'db_config': {'database': database},
+    }
+    return config, database
+
+def sweep(label, fetcher, database):
+    fetcher.metrics = MetricsRegistry()
+    servers = fetcher.get_valid_servers()
+    start = time.perf_counter()
+    fetcher.process_servers(servers)
+    elapsed = time.perf_counter() - start
+
+    connection = sqlite3.connect(database)
+    rows = connection.execute("SELECT COUNT(*) FROM components").fetchone()[0]
+    failed = connection.execute("SELECT COUNT(*) FROM servers WHERE update_status = 'Failure'").fetchone()[0]
+    connection.close()
+
+    summary = fetcher.metrics.summary()
+    stages = summary['stages']
+    written = sum(counter['value'] for counter in summary['counters'] if counter['name'] == 'components_written')
+    db_seconds = stages.get('db_write', {}).get('total_seconds', 0)
+    rows_per_second = f"{written} rows written at {written / db_seconds:.0f} rows/sec" if written and db_seconds else "no rows written"
+    print(f"{label:<18} {len(servers)} hosts in {elapsed:6.1f} s   {len(servers) / elapsed * 60:8.0f} hosts/min   "
+          f"{rows} component rows, {rows_per_second}, {failed} failed")
+    for stage in ('ssh_connect', 'interpreter_lookup', 'remote_exec', 'parse', 'db_write', 'scan'):
+        if stage in stages:
+            print(f"    {stage:<20} p50 {stages[stage]['p50_seconds'] * 1000:9.1f} ms   p95 {stages[stage]['p95_seconds'] * 1000:9.1f} ms")
+
+def search_latency(database, repeat):
+    searcher = RemoteDatabaseSearcher({'database': database}, connect=sqlite_connect)
+    searcher.connect(background=False)
+    samples = []
+    for query in QUERIES:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            searcher.find(query, 100)
+            samples.append(time.perf_counter() - start)
+    searcher.close()
+    print(f"{'search (first page)':<18} {len(searcher.index)} rows indexed   p50 {percentile(samples, 0.5) * 1000:.2f} ms   "
+          f"p95 {percentile(samples, 0.95) * 1000:.2f} ms   p99 {percentile(samples, 0.99) * 1000:.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end sweep over a simulated fleet with fake SSH and SQLite.")
+    parser.add_argument('--hosts', type=int, default=200, help='Simulated hosts')
+    parser.add_argument('--trees', type=int, default=4, help='Distinct synthetic /apps trees shared by the hosts')
+    parser.add_argument('--directories', type=int, default=2000, help='Directories per synthetic tree')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds of simulated latency per remote command')
+    parser.add_argument('--workers', type=int, default=16, help='Hosts scanned concurrently')
+    parser.add_argument('--repeat', type=int, default=20, help='Times each search query is run')
+    parser.add_argument('--format', choices=['ndjson', 'json', 'compact'], default='ndjson', help='Detector output format')
+    parser.add_argument('--versions', action='store_true', help='Run the detector with version enrichment')
+    parser.add_argument('--root', default=None, help='Keep the trees and database here instead of a temp dir')
+    args = parser.parse_args()
+
+    root = args.root or tempfile.mkdtemp(prefix='component-fleet-')
+    try:
+        config, database = build_fleet(root, args.hosts, args.trees, args.directories)
+        config['fetcher'] = {'workers': args.workers, 'region_concurrency': args.workers, 'output_format': args.format, 'versions': args.versions}
+        config_path = os.path.join(root, 'config.yaml')
+        with open(config_path, 'w') as config_file:
+            yaml.safe_dump(config, config_file)
+
+        state_dir = os.path.join(root, 'state')
+        shutil.rmtree(state_dir, ignore_errors=True)
+        os.makedirs(state_dir)
+        fleet = FakeFleet(state_dir, latency=args.latency)
+        ssh_pool = FakeSSHConnectionPool(fleet)
+        fetcher = ComponentFetcher(config_path, ssh_pool=ssh_pool, connect=sqlite_connect)
+        logger.remove()  # Per-host log lines would dominate the timings
+
+        sweep('cold sweep', fetcher, database)
+        sweep('unchanged sweep', fetcher, database)
+        fetcher.close()
+        search_latency(database, args.repeat)
+    finally:
+        if not args.root:
+            shutil.rmtree(root)
+
+if __name__ == "__main__":
+    main()
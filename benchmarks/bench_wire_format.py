@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from componentDetector import ComponentDetector
+from componentFetcher import decode_compact
+from synthetic_tree import generate_tree
+
+def best_of(rounds, function):
+    elapsed = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function()
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed), result
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the detector's JSON, NDJSON and compact payloads for one host.")
+    parser.add_argument('--components', type=int, default=5000, help='Components on the simulated host')
+    parser.add_argument('--bandwidth', type=float, default=2048, help='Link speed in kbit/s used to estimate transfer time')
+    parser.add_argument('--rounds', type=int, default=5, help='Repetitions per encode and decode')
+    parser.add_argument('--versions', action='store_true', help='Include component versions')
+    args = parser.parse_args()
+
+    # Roughly one directory in three of the synthetic tree is a component
+    root = tempfile.mkdtemp(prefix='component-wire-')
+    try:
+        base_dir = os.path.join(root, 'apps')
+        generate_tree(base_dir, args.components * 4)
+        detector = ComponentDetector(base_dir, versions=args.versions)
+        detector.gather_components()
+    finally:
+        shutil.rmtree(root)
+
+    components = detector.components[:args.components]
+    response = {"status": "success", "components": components, "message": "", "token": detector.compute_token()}
+    print(f"{len(components)} components, link {args.bandwidth:.0f} kbit/s")
+
+    encoders = [
+        ('json', lambda: json.dumps(response) + '\n', json.loads),
+        ('ndjson', lambda: ''.join(json.dumps(dict(component, type="component")) + '\n' for component in components),
+         lambda payload: [json.loads(line) for line in payload.splitlines()]),
+        ('compact', lambda: detector.encode_compact(response) + '\n', lambda payload: decode_compact(payload.strip())),
+    ]
+    baseline = None
+    for label, encode, decode in encoders:
+        encode_seconds, payload = best_of(args.rounds, encode)
+        decode_seconds, _ = best_of(args.rounds, lambda: decode(payload))
+        size = len(payload.encode('utf-8'))
+        baseline = baseline or size
+        transfer = size * 8 / (args.bandwidth * 1000)
+        print(f"{label:<8} {size:10d} bytes ({size / baseline:5.1%})   encode {encode_seconds * 1000:7.1f} ms   "
+              f"decode {decode_seconds * 1000:7.1f} ms   transfer {transfer * 1000:8.0f} ms")
+
+    decoded = decode_compact(detector.encode_compact(response))
+    assert decoded['components'] == components, "compact payload did not round-trip"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import io
+import os
+import re
+import sys
+import time
+import signal
+import sqlite3
+import subprocess
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sshConnectionPool import SSHConnectionPool
+
+# Stand-ins for MySQL and the SSH fleet, so the fetcher and searcher can be run and
+# measured offline. Only what those code paths use is implemented
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS servers (
+    server_ip VARCHAR(45) PRIMARY KEY, os VARCHAR(32), user VARCHAR(64), search_path VARCHAR(255),
+    region VARCHAR(64), running_state VARCHAR(32), server_name VARCHAR(255), last_updated_time TIMESTAMP,
+    update_status VARCHAR(16), error_message TEXT, scan_token VARCHAR(64), lease_owner VARCHAR(128),
+    lease_expires TIMESTAMP, scan_seconds FLOAT, consecutive_failures INT NOT NULL DEFAULT 0, parked_until TIMESTAMP,
+    last_scanned_time TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS platforms (platform_id INTEGER PRIMARY KEY, name VARCHAR(32) NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS component_catalog (
+    component_id INTEGER PRIMARY KEY, component_name VARCHAR(255) NOT NULL, platform_id INTEGER NOT NULL,
+    UNIQUE (component_name, platform_id)
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    host_id INTEGER PRIMARY KEY, ip VARCHAR(45) NOT NULL, region VARCHAR(64) NOT NULL, first_seen TIMESTAMP, last_seen TIMESTAMP,
+    component_count INT NOT NULL DEFAULT 0, UNIQUE (ip, region)
+);
+CREATE TABLE IF NOT EXISTS component_region_counts (
+    component_id INTEGER NOT NULL, region VARCHAR(64) NOT NULL, host_count INT NOT NULL DEFAULT 0, PRIMARY KEY (component_id, region)
+);
+CREATE TABLE IF NOT EXISTS platform_region_counts (
+    platform_id INTEGER NOT NULL, region VARCHAR(64) NOT NULL, host_count INT NOT NULL DEFAULT 0, PRIMARY KEY (platform_id, region)
+);
+CREATE TABLE IF NOT EXISTS region_counts (
+    region VARCHAR(64) PRIMARY KEY, host_count INT NOT NULL DEFAULT 0, component_count INT NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS host_components (
+    host_id INTEGER NOT NULL, component_id INTEGER NOT NULL, comp_path VARCHAR(1024), version VARCHAR(128),
+    PRIMARY KEY (host_id, component_id)
+);
+CREATE TABLE IF NOT EXISTS fetcher_sweeps (sweep_id INTEGER PRIMARY KEY, started_at TIMESTAMP, finished_at TIMESTAMP);
+INSERT OR IGNORE INTO fetcher_sweeps (sweep_id) VALUES (1);
+CREATE VIEW IF NOT EXISTS components AS
+    SELECT h.ip, h.region, cc.component_name, p.name AS platform, hc.comp_path, hc.version
+    FROM host_components hc
+    JOIN hosts h ON h.host_id = hc.host_id
+    JOIN component_catalog cc ON cc.component_id = hc.component_id
+    JOIN platforms p ON p.platform_id = cc.platform_id;
+"""
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+
+class SQLiteCursor:
+    # mysql.connector's cursor API over sqlite3: %s placeholders become ?, and NOW() plus or
+    # minus an INTERVAL becomes SQLite date arithmetic; locking reads rely on SQLite's database lock
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def translate(self, query):
+        query = query.replace('%s', '?').replace('INSERT IGNORE', 'INSERT OR IGNORE').replace('LEAST(', 'MIN(')
+        query = re.sub(r'\s+FOR UPDATE( SKIP LOCKED)?', '', query)
+        # A bare NOW() column would come back as text; declaring its type makes it a datetime
+        query = re.sub(r'^SELECT NOW\(\)$', 'SELECT NOW() AS "now [timestamp]"', query)
+        return re.sub(r"NOW\(\) ([+-]) INTERVAL \? SECOND", r"datetime(NOW(), '\1' || ? || ' seconds')", query)
+
+    def execute(self, query, params=()):
+        self.cursor.execute(self.translate(query), tuple(params or ()))
+
+    def executemany(self, query, rows):
+        self.cursor.executemany(self.translate(query), [tuple(row) for row in rows])
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchmany(self, size=1):
+        return self.cursor.fetchmany(size)
+
+    def close(self):
+        self.cursor.close()
+
+class SQLiteConnection:
+    def __init__(self, database):
+        self.connection = sqlite3.connect(database, timeout=60, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+        self.connection.create_function('NOW', 0, lambda: datetime.now().isoformat(' ', 'seconds'))
+        self.connection.execute('PRAGMA journal_mode=WAL')
+
+    @property
+    def autocommit(self):
+        return self.connection.isolation_level is None
+
+    @autocommit.setter
+    def autocommit(self, value):
+        self.connection.isolation_level = None if value else ''
+
+    def cursor(self, *args, **kwargs):
+        return SQLiteCursor(self.connection.cursor())
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def is_connected(self):
+        return True
+
+    def reconnect(self):
+        pass
+
+    def close(self):
+        self.connection.close()
+
+def sqlite_connect(database, **ignored):
+    # Drop-in for mysql.connector.connect: the connect factory of DatabasePool, ComponentFetcher,
+    # ServerDetailsManager and RemoteDatabaseSearcher; db_config only needs a database path
+    return SQLiteConnection(database)
+
+def create_database(database, servers):
+    # servers: (ip, user, search_path, region) of the simulated hosts, all waiting for a first scan
+    connection = sqlite3.connect(database)
+    connection.executescript(SCHEMA)
+    connection.executemany(
+        "INSERT OR REPLACE INTO servers (server_ip, user, search_path, region, running_state, update_status) VALUES (?, ?, ?, ?, 'running', 'Failure')",
+        servers
+    )
+    connection.commit()
+    connection.close()
+
+class FakeChannel:
+    def __init__(self, process=None):
+        self.process = process
+
+    def exit_status_ready(self):
+        return self.process is None or self.process.poll() is not None
+
+    def recv_exit_status(self):
+        return self.process.wait() if self.process else 0
+
+    def close(self):
+        # Like sshd hanging up on a closed channel: everything the command started goes
+        if self.process and self.process.poll() is None:
+            os.killpg(self.process.pid, signal.SIGKILL)
+
+class FakeChannelFile:
+    # Like paramiko's stdout: read() returns bytes, iterating yields text lines
+    def __init__(self, data=b'', process=None):
+        self.stream = process.stdout if process else io.BytesIO(data)
+        self.channel = FakeChannel(process)
+
+    def read(self):
+        return self.stream.read()
+
+    def __iter__(self):
+        for line in self.stream:
+            yield line.decode('utf-8', 'replace')
+
+class FakeStdin:
+    # Like paramiko's stdin: bytes written go to the command, shutdown_write ends its input
+    def __init__(self, process=None):
+        self.process = process
+        self.channel = self
+
+    def write(self, data):
+        if self.process:
+            self.process.stdin.write(data)
+
+    def flush(self):
+        if self.process:
+            self.process.stdin.flush()
+
+    def shutdown_write(self):
+        if self.process:
+            self.process.stdin.close()
+
+class FakeSSHClient:
+    # One simulated host. Every command pays the fleet's latency; the detector runs
+    # locally on the host's tree with a cache file of its own
+    def __init__(self, fleet, ip):
+        self.fleet = fleet
+        self.ip = ip
+        self.closed = False
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return not self.closed
+
+    def exec_command(self, command, timeout=None):
+        time.sleep(self.fleet.latency)
+        if command.startswith('which python'):
+            return FakeStdin(), FakeChannelFile(f"{sys.executable}\n".encode()), FakeChannelFile()
+
+        # The detector arrives on stdin as on a real host; only sudo and its cache location change
+        command = command.replace('sudo ', '', 1)
+        cache_path = os.path.join(self.fleet.state_dir, self.ip, 'detector-cache.json')
+        command = re.sub(r'--cache-file \S+', f"--cache-file {cache_path}", command)
+        process = subprocess.Popen(
+            command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, start_new_session=True
+        )
+        return FakeStdin(process), FakeChannelFile(process=process), FakeChannelFile()
+
+    def close(self):
+        self.closed = True
+
+class FakeFleet:
+    def __init__(self, state_dir, latency=0.05, connect_latency=None):
+        self.state_dir = state_dir
+        self.latency = latency
+        self.connect_latency = latency * 3 if connect_latency is None else connect_latency
+
+class FakeSSHConnectionPool(SSHConnectionPool):
+    # The real pool, with the TCP probe and paramiko handshake replaced by the fleet
+    def __init__(self, fleet, **kwargs):
+        super().__init__(**kwargs)
+        self.fleet = fleet
+
+    def port_open(self, ip, port=22):
+        return True
+
+    def handshake(self, ip, user, key_path):
+        time.sleep(self.fleet.connect_latency)
+        with self.lock:
+            self.handshakes[ip] += 1
+        return FakeSSHClient(self.fleet, ip)
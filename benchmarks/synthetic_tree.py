@@ -0,0 +1,50 @@
+import os
+import random
+from collections import deque
+
+COMPONENT_FILES = [
+    ('lib', 'app-core-1.4.2.jar'),
+    ('lib', 'libengine.so.3.1'),
+    ('bin', 'service.jar'),
+    ('', 'server.jar'),
+    ('', 'libfeed.so'),
+]
+NOISE_FILES = ['README', 'config.yaml', 'start.sh', 'stop.sh', 'app.log']
+EXCLUDED_NAMES = ['scripts', 'backup', 'jdk1.8', 'log-watcher']
+
+def generate_tree(root, directories=50000, seed=42, fanout=60):
+    # Builds an /apps-like tree of roughly `directories` directories: nested groups
+    # down to depth 3, leaves that are components (jar/.so in the dir, bin/ or lib/),
+    # plain directories, excluded names and solr/opa keyword directories
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    created = 0
+    frontier = deque([(root, 1)])
+    while frontier and created < directories:
+        parent, depth = frontier.popleft()
+        for index in range(fanout):
+            if created >= directories:
+                break
+            roll = rng.random()
+            if roll < 0.02:
+                name = rng.choice(EXCLUDED_NAMES) + str(index)
+            elif roll < 0.04:
+                name = rng.choice(['solr', 'opa']) + '-node' + str(index)
+            else:
+                name = 'app{}-{}'.format(depth, index)
+            path = os.path.join(parent, name)
+            os.makedirs(path, exist_ok=True)
+            created += 1
+            for noise in rng.sample(NOISE_FILES, 2):
+                open(os.path.join(path, noise), 'w').close()
+
+            if depth < 3 and roll >= 0.04 and rng.random() < 0.7:
+                frontier.append((path, depth + 1))
+            elif rng.random() < 0.5:
+                sub_dir, file_name = rng.choice(COMPONENT_FILES)
+                target = os.path.join(path, sub_dir) if sub_dir else path
+                if sub_dir:
+                    os.makedirs(target, exist_ok=True)
+                    created += 1
+                open(os.path.join(target, file_name), 'w').close()
+    return created
@@ -0,0 +1,65 @@
+import threading
+
+from databasePool import DatabasePool
+
+class ComponentCatalog:
+    def __init__(self, db_config, connect=None):
+        # Integer keys of platforms, catalog components and hosts. Keys are never deleted,
+        # so every one resolved is cached for good. Resolution runs on a connection of its
+        # own and commits at once: a ComponentWriter transaction stays open for a whole
+        # streamed scan, and new names inserted inside it would hold their unique-key
+        # locks, stalling every other host that reports them, until it commits
+        self.db_pool = DatabasePool(db_config, size=1, connect=connect)
+        self.lock = threading.Lock()
+        self.platforms = {}
+        self.components = {}
+        self.hosts = {}
+
+    def resolve(self, cursor, table, key_column, columns, keys):
+        # Inserts the missing keys (ignoring those another fetcher added meanwhile), then
+        # reads back the ids of all of them; keys are tuples of the columns' values. The
+        # ids are keyed by the stored values, which match the requested ones exactly only
+        # because names use a binary collation (migration 005)
+        cursor.executemany(
+            f"INSERT IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+            keys
+        )
+        ids = {}
+        first_values = sorted(set(key[0] for key in keys))
+        for start in range(0, len(first_values), 500):
+            chunk = first_values[start:start + 500]
+            cursor.execute(
+                f"SELECT {key_column}, {', '.join(columns)} FROM {table} WHERE {columns[0]} IN ({', '.join(['%s'] * len(chunk))})",
+                tuple(chunk)
+            )
+            for row in cursor.fetchall():
+                ids[tuple(row[1:])] = row[0]
+        return ids
+
+    def host_id(self, ip, region):
+        key = (ip, region)
+        if key not in self.hosts:
+            with self.lock, self.db_pool.transaction() as cursor:
+                self.hosts.update(self.resolve(cursor, 'hosts', 'host_id', ('ip', 'region'), [key]))
+        return self.hosts[key]
+
+    def component_ids(self, components):
+        # Maps (component_name, platform) pairs to catalog ids, adding new names and platforms
+        missing = set(components) - set(self.components)
+        if missing:
+            with self.lock, self.db_pool.transaction() as cursor:
+                new_platforms = set((platform,) for _, platform in missing) - set((name,) for name in self.platforms)
+                if new_platforms:
+                    found = self.resolve(cursor, 'platforms', 'platform_id', ('name',), sorted(new_platforms))
+                    self.platforms.update((name, platform_id) for (name,), platform_id in found.items())
+                keys = sorted((name, self.platforms[platform]) for name, platform in missing)
+                found = self.resolve(cursor, 'component_catalog', 'component_id', ('component_name', 'platform_id'), keys)
+                names = {platform_id: name for name, platform_id in self.platforms.items()}
+                self.components.update(((name, names[platform_id]), component_id) for (name, platform_id), component_id in found.items())
+        unresolved = [component for component in components if component not in self.components]
+        if unresolved:
+            raise LookupError(f"No exact catalog match for {unresolved[:5]}; names need the binary collation of migration 005")
+        return {component: self.components[component] for component in components}
+
+    def close(self):
+        self.db_pool.close()
@@ -1,20 +1,83 @@
 import os
 import json
+import zlib
+import base64
 import argparse
 import sys
 import re
+import hashlib
+import stat
+import tempfile
+import threading
+import zipfile
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # Python 2
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  # Backport used by some Python 2 hosts
+    except ImportError:
+        scandir = None
+
+# First characters of a compact payload line, naming the format and its version
+COMPACT_PREFIX = 'CIv1:'
 
 class ComponentDetector:
-    def __init__(self, base_dir, max_depth=3):
+    def __init__(self, base_dir, max_depth=3, cache_file=None, since_token=None, workers=1, output_format='json', versions=False):
         self.base_dir = base_dir
         self.max_depth = max_depth
+        self.workers = max(1, workers)
+        self.output_format = output_format
         self.exclude_keywords = ['script', 'watcher', 'tar', 'runtime', 'backup', 'jdk', 'dd-agent']
         self.special_keywords = {'solr': 'Java', 'opa': 'opa'}
         self.file_extensions = {'.jar': 'Java'}
-        self.so_pattern = re.compile(r"\.so(\.\d+)*$") # Matches .so and .so.version
+
+        # One combined pattern classifies a file name in a single search; the group
+        # that matched tells the platform (.so and .so.version mean C++)
+        patterns = []
+        self.pattern_platforms = {}
+        for index, (extension, platform) in enumerate(sorted(self.file_extensions.items())):
+            group = 'ext{}'.format(index)
+            patterns.append('(?P<{}>{}$)'.format(group, re.escape(extension)))
+            self.pattern_platforms[group] = platform
+        patterns.append(r'(?P<so>\.so(\.\d+)*$)')
+        self.pattern_platforms['so'] = 'C++'
+        self.file_pattern = re.compile('|'.join(patterns))
+
+        # Version enrichment: read from a jar's manifest or pom.properties, or a .so.X.Y suffix
+        self.versions = versions
+        self.so_version = re.compile(r'\.so\.(\d+(?:\.\d+)*)$')
+        self.manifest_version = re.compile(r'^(?:Implementation-Version|Bundle-Version):\s*(\S+)', re.MULTILINE)
+        self.pom_version = re.compile(r'^version=(\S+)', re.MULTILINE)
+
         self.status = "failure"
         self.components = []
         self.message = ''
+        self.token = None
+        self.token_sum = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+        # Streaming mode holds components back while every directory still matches the
+        # cache, so an unchanged host answers with a status line only
+        self.holding = False
+        self.held = []
+        self.max_held = 5000
+
+        # Incremental mode: results of the previous run, keyed by directory path
+        self.cache_file = os.path.expanduser(cache_file) if cache_file else None
+        self.since_token = since_token
+        self.cache = {}
+        self.cache_token = None
+        self.new_cache = {}
+        self.fingerprints = {}
+        self.version_cache = {}
+        self.new_version_cache = {}
 
     def is_excluded_directory(self, dir_name):
         return any(keyword in dir_name.lower() for keyword in self.exclude_keywords)
@@ -25,88 +88,408 @@ class ComponentDetector:
                 return platform
         return None
 
-    def identify_component(self, dir_path):
-        comp_name = os.path.basename(dir_path)
-        platform = self.get_platform(comp_name)
-
-        if os.path.isdir(dir_path) and platform:
-            return {"comp_name": comp_name, "platform": platform, "path": dir_path}
+    def scan_directory(self, dir_path):
+        # Single listing pass: every entry name, plus the names that are directories.
+        # scandir gets the entry type from the listing itself instead of a stat per child
+        names = []
+        dirs = []
+        if scandir is not None:
+            for entry in scandir(dir_path):
+                names.append(entry.name)
+                if entry.is_dir():
+                    dirs.append(entry.name)
+        else:
+            for name in os.listdir(dir_path):
+                names.append(name)
+                if os.path.isdir(os.path.join(dir_path, name)):
+                    dirs.append(name)
+        return names, dirs
 
-        try:
-            files = os.listdir(dir_path)
-        except (OSError, IOError) as e:
-            raise e
+    def classify_files(self, names):
+        for name in names:
+            match = self.file_pattern.search(name)
+            if match:
+                return self.pattern_platforms[match.lastgroup]
+        return None
 
-        for file in files:
-            for extension, platform in self.file_extensions.items():
-                if file.endswith(extension):
-                    return {"comp_name": comp_name, "platform": platform, "path": dir_path}
-            if self.so_pattern.search(file):
-                return {"comp_name": comp_name, "platform": "C++", "path": dir_path}
+    def identify_component(self, dir_path, names, dirs):
+        comp_name = os.path.basename(dir_path)
+        platform = self.get_platform(comp_name) or self.classify_files(names)
+        if platform:
+            return {"comp_name": comp_name, "platform": platform, "path": dir_path}
 
         for sub_dir in ['bin', 'lib']:
-            sub_dir_path = os.path.join(dir_path, sub_dir)
-            if os.path.isdir(sub_dir_path):
+            if sub_dir in dirs:
                 try:
-                    files = os.listdir(sub_dir_path)
+                    sub_names, _ = self.scan_directory(os.path.join(dir_path, sub_dir))
                 except (OSError, IOError):
                     continue
-
-                for file in files:
-                    for extension, platform in self.file_extensions.items():
-                        if file.endswith(extension):
-                            return {"comp_name": comp_name, "platform": platform, "path": dir_path}
-                    if self.so_pattern.search(file):
-                        return {"comp_name": comp_name, "platform": "C++", "path": dir_path}
+                platform = self.classify_files(sub_names)
+                if platform:
+                    return {"comp_name": comp_name, "platform": platform, "path": dir_path}
 
         return None
 
+    def filter_directories(self, current_dir, dirs):
+        return [os.path.join(current_dir, directory) for directory in dirs if not self.is_excluded_directory(directory)]
+
     def get_valid_directories(self, current_dir):
         dirs = []
         try:
-            for directory in os.listdir(current_dir):
-                dir_path = os.path.join(current_dir, directory)
-                if os.path.isdir(dir_path) and not self.is_excluded_directory(directory):
-                    dirs.append(dir_path)
+            _, dirs = self.scan_directory(current_dir)
         except OSError:
             self.status = "failure"
             self.message = "{} not found".format(current_dir)
         except IOError:
             self.status = "failure"
             self.message = "Permission denied for accessing {}".format(current_dir)
+        return self.filter_directories(current_dir, dirs)
+
+    def private_cache_dir(self):
+        # The cache decides what gets reported and root may be the one writing it, so it is
+        # only used inside a directory owned by this user that nobody else can enter
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_file))
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, 0o700)
+            status = os.lstat(cache_dir)
+        except OSError:
+            return None
+        if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or status.st_mode & 0o077:
+            return None
+        return cache_dir
+
+    def load_cache(self):
+        if not self.cache_file:
+            return
+        if not self.private_cache_dir():
+            self.cache_file = None  # Scan without a cache rather than trust or write a shared one
+            return
+        try:
+            with open(self.cache_file, 'r') as cache_file:
+                cache = json.load(cache_file)
+            if cache.get('base_dir') == self.base_dir and cache.get('max_depth') == self.max_depth:
+                self.cache = cache.get('dirs', {})
+                self.cache_token = cache.get('token')
+                self.version_cache = cache.get('versions', {})
+        except (OSError, IOError, ValueError):
+            self.cache = {}
+
+    def save_cache(self):
+        if not self.cache_file:
+            return
+        cache = {
+            "base_dir": self.base_dir, "max_depth": self.max_depth, "token": self.token,
+            "dirs": self.new_cache, "versions": self.new_version_cache
+        }
+        temp_path = None
+        try:
+            # A fresh name from mkstemp in the private directory, renamed over the cache once complete
+            handle, temp_path = tempfile.mkstemp(prefix='.cache-', dir=os.path.dirname(os.path.abspath(self.cache_file)))
+            with os.fdopen(handle, 'w') as cache_file:
+                json.dump(cache, cache_file)
+            os.rename(temp_path, self.cache_file)
+        except (OSError, IOError):
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)  # The cache only saves work on the next run
+
+    def fingerprint(self, dir_path):
+        # What we detect in a directory depends only on its own listing and the listings
+        # of bin/ and lib/, and any change to a listing moves that directory's mtime/ctime
+        if dir_path not in self.fingerprints:
+            fingerprint = []
+            for path in [dir_path, os.path.join(dir_path, 'bin'), os.path.join(dir_path, 'lib')]:
+                try:
+                    stat = os.stat(path)
+                    fingerprint.append([stat.st_ino, stat.st_mtime, stat.st_ctime])
+                except OSError:
+                    fingerprint.append(None)
+            self.fingerprints[dir_path] = fingerprint if fingerprint[0] else None
+        return self.fingerprints[dir_path]
+
+    def lookup(self, dir_path):
+        if not self.cache_file:
+            return None
+        fingerprint = self.fingerprint(dir_path)
+        entry = self.cache.get(dir_path)
+        if (fingerprint is None or not entry or entry.get('fingerprint') != fingerprint or 'subdirs' not in entry
+                or (self.versions and 'artifact' not in entry)):
+            if self.holding:
+                self.release_held()
+            return None
+        self.remember(dir_path, entry.get('component'), entry['subdirs'], entry.get('artifact'))
+        return entry
+
+    def remember(self, dir_path, component, subdirs, artifact=None):
+        fingerprint = self.fingerprint(dir_path) if self.cache_file else None
+        if fingerprint is not None:
+            entry = {'fingerprint': fingerprint, 'component': component, 'subdirs': subdirs}
+            if self.versions:
+                entry['artifact'] = artifact
+            self.new_cache[dir_path] = entry
+
+    def pick_artifact(self, dir_path, names=None, dirs=None):
+        # The jar or .so a component's version is read from: one in the directory, else in
+        # lib/ or bin/, preferring a file named after the component
+        if names is None:
+            try:
+                names, dirs = self.scan_directory(dir_path)
+            except (OSError, IOError):
+                return None
+        prefix = os.path.basename(dir_path).lower()
+        for sub_dir in ['', 'lib', 'bin']:
+            if not sub_dir:
+                sub_names = names
+            elif sub_dir not in dirs:
+                continue
+            else:
+                try:
+                    sub_names, _ = self.scan_directory(os.path.join(dir_path, sub_dir))
+                except (OSError, IOError):
+                    continue
+            candidates = sorted(name for name in sub_names if self.file_pattern.search(name))
+            if candidates:
+                named = [name for name in candidates if name.lower().startswith(prefix)]
+                return os.path.join(dir_path, sub_dir, (named or candidates)[0])
+        return None
+
+    def read_version(self, path):
+        # Opening a jar reads only the zip central directory, then the one entry needed
+        match = self.so_version.search(path)
+        if match:
+            return match.group(1)
+        if not path.endswith('.jar'):
+            return None
+        try:
+            archive = zipfile.ZipFile(path)
+            try:
+                entries = archive.namelist()
+                if 'META-INF/MANIFEST.MF' in entries:
+                    match = self.manifest_version.search(archive.read('META-INF/MANIFEST.MF').decode('utf-8', 'replace'))
+                    if match:
+                        return match.group(1)
+                for entry in entries:
+                    if entry.startswith('META-INF/maven/') and entry.endswith('/pom.properties'):
+                        match = self.pom_version.search(archive.read(entry).decode('utf-8', 'replace'))
+                        if match:
+                            return match.group(1)
+            finally:
+                archive.close()
+        except (OSError, IOError, zipfile.BadZipfile, KeyError):
+            pass
+        return None
+
+    def artifact_version(self, path):
+        # Cached by (path, inode, mtime, size), so an unchanged artifact is never reopened
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = [stat.st_ino, stat.st_mtime, stat.st_size]
+        entry = self.version_cache.get(path)
+        version = entry[3] if entry and entry[:3] == key else self.read_version(path)
+        self.new_version_cache[path] = key + [version]
+        return version
+
+    def with_version(self, component, artifact):
+        if not self.versions or not component:
+            return component
+        return dict(component, version=self.artifact_version(artifact) if artifact else None)
+
+    def visit_directory(self, dir_path):
+        # Identifies dir_path and collects its subdirectories from the same listing
+        entry = self.lookup(dir_path)
+        if entry is not None:
+            return self.with_version(entry.get('component'), entry.get('artifact')), entry['subdirs']
+
+        component = None
+        subdirs = []
+        artifact = None
+        platform = self.get_platform(os.path.basename(dir_path))
+        if platform:
+            component = {"comp_name": os.path.basename(dir_path), "platform": platform, "path": dir_path}
+            if self.versions:
+                artifact = self.pick_artifact(dir_path)
+        else:
+            names, dirs = self.scan_directory(dir_path)
+            component = self.identify_component(dir_path, names, dirs)
+            if not component:
+                subdirs = self.filter_directories(dir_path, dirs)
+            elif self.versions:
+                artifact = self.pick_artifact(dir_path, names, dirs)
+        self.remember(dir_path, component, subdirs, artifact)
+        return self.with_version(component, artifact), subdirs
+
+    def list_base_directories(self):
+        entry = self.lookup(self.base_dir)
+        if entry is not None:
+            return entry['subdirs']
+        dirs = self.get_valid_directories(self.base_dir)
+        self.remember(self.base_dir, None, dirs)
         return dirs
 
-    def traverse_directory(self, dir_path, depth):
+    def write_line(self, record):
+        sys.stdout.write(json.dumps(record) + '\n')
+
+    def found_component(self, component):
+        # The token is an order-independent sum of component hashes, so it can be
+        # computed while streaming and is the same whatever order subtrees finish in
+        digest = hashlib.sha1(json.dumps(component, sort_keys=True).encode('utf-8')).hexdigest()
+        with self.lock:
+            self.token_sum = (self.token_sum + int(digest, 16)) % (1 << 160)
+            self.count += 1
+            if self.output_format != 'ndjson':
+                self.components.append(component)
+            elif self.holding and len(self.held) < self.max_held:
+                self.held.append(component)
+            else:
+                self.release_held(locked=True)
+                self.write_line(dict(component, type="component"))
+
+    def release_held(self, locked=False):
+        if not locked:
+            with self.lock:
+                return self.release_held(locked=True)
+        self.holding = False
+        for component in self.held:
+            self.write_line(dict(component, type="component"))
+        self.held = []
+
+    def traverse_directory(self, dirs, depth, found):
         if depth > self.max_depth:
             return
-        dirs = self.get_valid_directories(dir_path)
         for subdir_path in dirs:
-            component = self.identify_component(subdir_path)
+            component, subdirs = self.visit_directory(subdir_path)
             if component:
-                self.components.append(component)
+                found(component)
             else:
-                self.traverse_directory(subdir_path, depth + 1)
+                self.traverse_directory(subdirs, depth + 1, found)
+
+    def traverse_parallel(self, dirs):
+        # Top-level subtrees are scanned by a pool of threads (the work is I/O bound,
+        # listings release the GIL). The JSON document merges them back in listing order,
+        # so it is the same as a sequential scan; streaming emits components as found
+        stream = self.output_format == 'ndjson'
+        results = [None] * len(dirs)
+        errors = [None] * len(dirs)
+        tasks = queue.Queue()
+        for index, dir_path in enumerate(dirs):
+            tasks.put((index, dir_path))
+
+        def worker():
+            while True:
+                try:
+                    index, dir_path = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                components = []
+                try:
+                    self.traverse_directory([dir_path], 1, self.found_component if stream else components.append)
+                except Exception as e:
+                    errors[index] = e
+                results[index] = components
+
+        threads = [threading.Thread(target=worker) for _ in range(min(self.workers, len(dirs)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for index in range(len(dirs)):
+            for component in results[index] or []:
+                self.found_component(component)
+            if errors[index] is not None:
+                raise errors[index]
+
+    def compute_token(self):
+        return '{:040x}'.format(self.token_sum)
 
     def gather_components(self):
-        self.traverse_directory(self.base_dir, 1)
+        self.load_cache()
+        self.holding = self.output_format == 'ndjson' and bool(self.since_token) and self.since_token == self.cache_token
+        dirs = self.list_base_directories()
+        if self.workers > 1 and len(dirs) > 1:
+            self.traverse_parallel(dirs)
+        else:
+            self.traverse_directory(dirs, 1, self.found_component)
         self.status = "success"
+        self.token = self.compute_token()
+        self.save_cache()
+
+    def run_stream(self):
+        # One JSON line per component as it is found, then a final status line
+        try:
+            self.gather_components()
+            status = {"type": "status", "status": self.status, "message": self.message, "token": self.token, "count": self.count}
+            if self.since_token and self.since_token == self.token:
+                self.held = []
+                status["status"] = "unchanged"
+                status["message"] = "No change since {}".format(self.since_token)
+            else:
+                self.release_held()
+        except Exception as e:
+            self.release_held()
+            status = {"type": "status", "status": "failure", "message": str(e), "token": None, "count": self.count}
+        self.write_line(status)
+        sys.stdout.flush()
+
+    def encode_compact(self, response):
+        # The JSON response as columns: names, platform codes into a platform table, paths
+        # relative to the base directory and versions. zlib and base64 turn it into a
+        # single line that survives any shell or channel in between
+        components = response.get("components") or []
+        platforms = sorted(set(component["platform"] for component in components))
+        codes = dict((platform, code) for code, platform in enumerate(platforms))
+        prefix = self.base_dir.rstrip('/') + '/'
+        document = {
+            "status": response.get("status"),
+            "message": response.get("message"),
+            "token": response.get("token"),
+            "base": prefix,
+            "platforms": platforms,
+            "names": [component["comp_name"] for component in components],
+            "codes": [codes[component["platform"]] for component in components],
+            "paths": [
+                component["path"][len(prefix):] if component["path"].startswith(prefix) else component["path"]
+                for component in components
+            ],
+        }
+        if self.versions:
+            document["versions"] = [component.get("version") for component in components]
+        payload = zlib.compress(json.dumps(document, separators=(',', ':')).encode('utf-8'))
+        return COMPACT_PREFIX + base64.b64encode(payload).decode('ascii')
+
+    def print_response(self, response):
+        if self.output_format == 'compact':
+            print(self.encode_compact(response))
+        else:
+            print(json.dumps(response))
 
     def run(self):
+        if self.output_format == 'ndjson':
+            return self.run_stream()
         try:
             self.gather_components()
             response = {
                 "status": self.status,
                 "components": self.components,
-                "message": self.message
+                "message": self.message,
+                "token": self.token
             }
-            print(json.dumps(response))
+            if self.since_token and self.since_token == self.token:
+                # Nothing changed since the caller's last scan, no need to send the components again
+                response["status"] = "unchanged"
+                response["components"] = []
+                response["message"] = "No change since {}".format(self.since_token)
+            self.print_response(response)
         except Exception as e:
             response = {
                 "status": "failure",
                 "components": self.components,
                 "message": str(e)
             }
-            print(json.dumps(response))
+            self.print_response(response)
 
 if __name__ == "__main__":
     # Ensure compatibility with Python 2 and 3 for input function
@@ -116,10 +499,17 @@ if __name__ == "__main__":
     # Set up argument parsing
     parser = argparse.ArgumentParser(description="Gather components from a directory.")
     parser.add_argument('base_dir', type=str, help='Base directory to start the search')
+    parser.add_argument('--cache-file', type=str, default=None, help='Cache file enabling incremental scans, kept in a directory private to this user')
+    parser.add_argument('--since', type=str, default=None, help='Token of the previous scan; report "unchanged" if it still matches')
+    parser.add_argument('--workers', type=int, default=1, help='Threads scanning top-level subtrees in parallel')
+    parser.add_argument('--format', choices=['json', 'ndjson', 'compact'], default='json',
+                        help='One JSON document, one JSON line per component, or one compressed columnar line')
+    parser.add_argument('--versions', action='store_true', help='Add each component\'s version, read from its jar manifest, pom.properties or .so suffix')
     
     # Parse arguments
     args = parser.parse_args()
     
     # Create an instance of ComponentDetector and run
-    detector = ComponentDetector(args.base_dir)
+    detector = ComponentDetector(args.base_dir, cache_file=args.cache_file, since_token=args.since, workers=args.workers, output_format=args.format,
+                                 versions=args.versions)
     detector.run()
@@ -1,14 +1,58 @@
 import os
-import paramiko
-import mysql.connector
+import argparse
 import json
 import yaml
 import re
-from datetime import datetime
+import zlib
+import base64
+import math
+import socket
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
 from loguru import logger
 
+from databasePool import DatabasePool
+from componentWriter import ComponentWriter
+from componentCatalog import ComponentCatalog
+from sshConnectionPool import SSHConnectionPool
+from ServerDetailsManager import ServerDetailsManager
+from componentScheduler import ComponentScheduler
+from metricsRegistry import MetricsRegistry
+from componentDetector import COMPACT_PREFIX
+
+SERVER_QUERY_COLUMNS = (
+    "server_ip, user, search_path, region, update_status, scan_token, last_updated_time, "
+    "scan_seconds, consecutive_failures, parked_until, last_scanned_time"
+)
+
+def decode_compact(line):
+    # Turns a compact payload line from the detector back into its JSON response; a
+    # payload that is truncated or not shaped as the detector writes it raises ValueError
+    try:
+        document = json.loads(zlib.decompress(base64.b64decode(line[len(COMPACT_PREFIX):])))
+    except zlib.error as e:
+        raise ValueError(f"Truncated compact payload: {e}")
+    try:
+        base, platforms = document['base'], document['platforms']
+        names, codes, paths = document['names'], document['codes'], document['paths']
+        versions = document.get('versions')
+        if not len(names) == len(codes) == len(paths) or (versions is not None and len(versions) != len(names)):
+            raise ValueError("columns of different lengths")
+        components = []
+        for index, (name, code, path) in enumerate(zip(names, codes, paths)):
+            component = {'comp_name': name, 'platform': platforms[code], 'path': path if path.startswith('/') else base + path}
+            if versions is not None:
+                component['version'] = versions[index]
+            components.append(component)
+        return {'status': document['status'], 'message': document['message'], 'token': document['token'], 'components': components}
+    except (KeyError, IndexError, TypeError, AttributeError) as e:
+        raise ValueError(f"Malformed compact payload: {e!r}")
+
 class ComponentFetcher:
-    def __init__(self, config_file):
+    def __init__(self, config_file, workers=None, ssh_pool=None, metrics=None, connect=None):
         # Load configuration from YAML file
         with open(config_file, 'r') as file:
             config = yaml.safe_load(file)
@@ -16,17 +60,67 @@ class ComponentFetcher:
         # AWS Regions and Datacenter configurations
         self.regions = config['aws']['regions']
         self.datacenters = config['datacenters']
-        
-        # Database connection setup
+
+        # Scan concurrency and timeouts
+        fetcher_config = config.get('fetcher') or {}
+        self.workers = max(1, int(workers or fetcher_config.get('workers', 1)))
+        self.region_concurrency = fetcher_config.get('region_concurrency')
+        self.region_limits = fetcher_config.get('region_limits') or {}
+        self.connect_timeout = fetcher_config.get('connect_timeout', 10)
+        self.host_timeout = fetcher_config.get('host_timeout', 900)
+        self.min_host_timeout = min(fetcher_config.get('min_host_timeout', 120), self.host_timeout)
+        self.timeout_factor = fetcher_config.get('timeout_factor', 3)
+        self.park_after = fetcher_config.get('park_after', 3)
+        self.park_base = fetcher_config.get('park_base', 3600)
+        self.park_max = fetcher_config.get('park_max', 86400)
+        self.host_deadlines = {}
+        self.scan_results = {}
+        self.incremental = fetcher_config.get('incremental', True)
+        self.detector_workers = fetcher_config.get('detector_workers', 1)
+        self.output_format = fetcher_config.get('output_format', 'ndjson')
+        self.write_batch_size = fetcher_config.get('write_batch_size', 500)
+        self.versions = fetcher_config.get('versions', False)
+
+        # Sharded mode: several fetchers split the fleet through leases in the servers table
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = fetcher_config.get('lease_seconds', max(1800, 2 * self.host_timeout))
+        self.lease_batch = fetcher_config.get('lease_batch', 10)
+        self.rescan_after = fetcher_config.get('rescan_after', 3600)
+        self.shard_regions = None
+
+        # Shared SSH connections, kept open between scans until idle for ssh_idle_ttl seconds,
+        # plus the interpreter found on each host
+        self.owns_ssh_pool = ssh_pool is None
+        self.ssh_pool = ssh_pool or SSHConnectionPool(
+            connect_timeout=self.connect_timeout, idle_ttl=fetcher_config.get('ssh_idle_ttl', 300)
+        )
+        self.interpreters = {}
+
+        # Stage timings per region, exported as a textfile, over /metrics and as a run summary
+        metrics_config = config.get('metrics') or {}
+        self.metrics = metrics or MetricsRegistry()
+        self.metrics_textfile = metrics_config.get('textfile')
+        self.metrics_port = metrics_config.get('port')
+        self.metrics_summary_dir = metrics_config.get('summary_dir')
+        self.host_regions = {}
+
+        # Database connection setup, one pooled connection per worker
         self.db_config = config['db_config']
-        self.db_connection = mysql.connector.connect(**self.db_config)
-        self.cursor = self.db_connection.cursor()
+        self.db_pool = DatabasePool(self.db_config, size=self.workers, connect=connect)
+        self.catalog = ComponentCatalog(self.db_config, connect=connect)
         
-        # Path to the local and remote script
-        self.local_script_path = 'componentDetector.py'
-        self.remote_script_path = '/tmp/componentDetector.py'
-        self.use_sudo = True
+        # The detector is sent to each run's interpreter over stdin, never stored on the host:
+        # a script left in /tmp could be swapped by any local user before sudo runs it
         self.script_directory = os.path.dirname(os.path.abspath(__file__))
+        self.local_script_path = os.path.join(self.script_directory, 'componentDetector.py')
+        with open(self.local_script_path, 'rb') as script_file:
+            self.script_content = script_file.read()
+        # The detector's cache decides what a scan reports, so it lives in a directory private
+        # to the user running the detector: root's under sudo, the login user's otherwise
+        self.remote_cache_path = '/var/cache/component-inventory/detector-cache.json'
+        self.user_cache_path = '~/.cache/component-inventory/detector-cache.json'
+        if self.metrics_summary_dir is None:
+            self.metrics_summary_dir = os.path.join(self.script_directory, 'logs')
 
         # Set up logging
         log_file_path = os.path.join(self.script_directory, './logs/component_fetcher_{time:YYYYMMDDHHmmss}.log')
@@ -38,161 +132,516 @@ class ComponentFetcher:
         )
 
 
+    def scan_regions(self):
+        all_regions = []
+        if self.regions:
+            all_regions = all_regions + list(self.regions.keys()) 
+        if self.datacenters:
+            all_regions = all_regions + list(self.datacenters.keys())
+        if self.shard_regions:
+            all_regions = [region for region in all_regions if region in self.shard_regions]
+        return all_regions
+
+    def server_from_row(self, row):
+        return {
+            'ip': row[0], 'user': row[1], 'search_path': row[2], 'region': row[3],
+            'update_status': row[4], 'scan_token': row[5], 'last_updated_time': row[6],
+            'scan_seconds': row[7], 'consecutive_failures': row[8] or 0, 'parked_until': row[9],
+            'last_scanned_time': row[10]
+        }
+
     def get_valid_servers(self):
         try:
-            # Fetch servers, prioritizing those with failures first
-            all_regions = []
-            if self.regions:
-                all_regions = all_regions + list(self.regions.keys()) 
-            if self.datacenters:
-                all_regions = all_regions + list(self.datacenters.keys())
+            # Fetch servers, prioritizing those with failures first; parked servers are
+            # left out until their parking time is over
+            all_regions = self.scan_regions()
             placeholders = ', '.join(['%s'] * len(all_regions))
             query = f"""
-                SELECT server_ip, user, search_path, region, update_status
+                SELECT {SERVER_QUERY_COLUMNS}
                 FROM servers
                 WHERE user IS NOT NULL
                 AND region IN ({placeholders})
                 AND running_state = 'running'
+                AND (parked_until IS NULL OR parked_until <= NOW())
                 ORDER BY 
-                    CASE WHEN update_status = 'failure' THEN 0 ELSE 1 END,
+                    CASE WHEN update_status IN ('failure', 'parked') THEN 0 ELSE 1 END,
                     last_updated_time ASC
             """
 
-            self.cursor.execute(query, tuple(all_regions))
-            servers = [
-                {'ip': row[0], 'user': row[1], 'search_path': row[2], 'region': row[3], 'update_status': row[4]} 
-                for row in self.cursor.fetchall()
-            ]
+            with self.db_pool.transaction() as cursor:
+                cursor.execute(query, tuple(all_regions))
+                servers = [self.server_from_row(row) for row in cursor.fetchall()]
             logger.info(f"Fetched {len(servers)} valid servers from the database with failure instances prioritized.")
             return servers
         except Exception as e:
             logger.error(f"Error fetching servers: {e}")
             return []
 
-    def get_python_interpreter(self, ssh_client):
-        # Check if python is available
-        stdin, stdout, stderr = ssh_client.exec_command('which python')
-        python_path = stdout.read().decode('utf-8').strip()
-        
-        if not python_path:
-            # Check if python3 is available
-            stdin, stdout, stderr = ssh_client.exec_command('which python3')
-            python_path = stdout.read().decode('utf-8').strip()
-        
-        if python_path:
-            logger.info(f"Using Python interpreter: {python_path}")
-            return python_path
-        else:
+    def claim_servers(self, limit, sweep_started, regions=None):
+        # Leases up to limit servers not scanned since the shared sweep started (nor within
+        # rescan_after seconds) and not leased by a live worker. A host never scanned has no
+        # last_scanned_time and is claimable however recently discovery probed it. Every
+        # timestamp compared here is written with the database's NOW(), so node clocks never
+        # matter. SKIP LOCKED lets concurrent claims from other fetchers pass over the rows
+        # locked here, so every server goes to exactly one of them; an expired lease is free again
+        all_regions = self.scan_regions() if regions is None else regions
+        if not all_regions or limit <= 0:
+            return []
+        placeholders = ', '.join(['%s'] * len(all_regions))
+        query = f"""
+            SELECT {SERVER_QUERY_COLUMNS}
+            FROM servers
+            WHERE user IS NOT NULL
+            AND region IN ({placeholders})
+            AND running_state = 'running'
+            AND (parked_until IS NULL OR parked_until <= NOW())
+            AND (lease_expires IS NULL OR lease_expires < NOW())
+            AND (last_scanned_time IS NULL OR last_scanned_time < LEAST(%s, NOW() - INTERVAL %s SECOND))
+            ORDER BY 
+                CASE WHEN update_status IN ('failure', 'parked') THEN 0 ELSE 1 END,
+                last_scanned_time ASC
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """
+        with self.db_pool.transaction() as cursor:
+            cursor.execute(query, tuple(all_regions) + (sweep_started, self.rescan_after, limit))
+            servers = [self.server_from_row(row) for row in cursor.fetchall()]
+            if servers:
+                cursor.executemany(
+                    "UPDATE servers SET lease_owner = %s, lease_expires = NOW() + INTERVAL %s SECOND WHERE server_ip = %s",
+                    [(self.worker_id, self.lease_seconds, server['ip']) for server in servers]
+                )
+        return servers
+
+    def claim_within_caps(self, limit, sweep_started, running):
+        # Claims up to limit servers without taking any region past region_limit(), given
+        # the scans running per region. While no region is that close to its cap one claim
+        # over all of them does; otherwise each region with room is claimed from in turn
+        rooms = {region: self.region_limit(region) - running[region] for region in self.scan_regions()}
+        open_regions = [region for region, room in rooms.items() if room > 0]
+        if not open_regions:
+            return []
+        if all(rooms[region] >= limit for region in open_regions):
+            return self.claim_servers(limit, sweep_started, open_regions)
+        claimed = []
+        for region in open_regions:
+            if len(claimed) >= limit:
+                break
+            claimed.extend(self.claim_servers(min(limit - len(claimed), rooms[region]), sweep_started, [region]))
+        return claimed
+
+    def renew_leases(self, ips):
+        if not ips:
+            return
+        with self.db_pool.transaction() as cursor:
+            cursor.executemany(
+                "UPDATE servers SET lease_expires = NOW() + INTERVAL %s SECOND WHERE server_ip = %s AND lease_owner = %s",
+                [(self.lease_seconds, ip, self.worker_id) for ip in ips]
+            )
+
+    def release_lease(self, ip):
+        try:
+            with self.db_pool.transaction() as cursor:
+                cursor.execute(
+                    "UPDATE servers SET lease_owner = NULL, lease_expires = NULL WHERE server_ip = %s AND lease_owner = %s",
+                    (ip, self.worker_id)
+                )
+        except Exception as e:
+            logger.error(f"Failed to release the lease on {ip}, it expires in {self.lease_seconds}s: {e}")
+
+    def join_sweep(self):
+        # Returns the start of the sweep in progress, so every node of a sweep claims against
+        # the same marker, or starts a new sweep once the last one has finished
+        with self.db_pool.transaction() as cursor:
+            cursor.execute("SELECT started_at, finished_at FROM fetcher_sweeps WHERE sweep_id = 1 FOR UPDATE")
+            row = cursor.fetchone()
+            if row and row[0] is not None and row[1] is None:
+                return row[0]
+            cursor.execute("REPLACE INTO fetcher_sweeps (sweep_id, started_at, finished_at) VALUES (1, NOW(), NULL)")
+            cursor.execute("SELECT started_at FROM fetcher_sweeps WHERE sweep_id = 1")
+            return cursor.fetchone()[0]
+
+    def finish_sweep(self, sweep_started):
+        with self.db_pool.transaction() as cursor:
+            cursor.execute(
+                "UPDATE fetcher_sweeps SET finished_at = NOW() WHERE sweep_id = 1 AND started_at = %s AND finished_at IS NULL",
+                (sweep_started,)
+            )
+
+    def process_sharded(self):
+        # One sweep shared with the other sharded fetchers: servers are claimed a batch at
+        # a time, never more than there are free workers nor past a region's cap, and
+        # released once scanned
+        sweep_started = self.join_sweep()
+        logger.info(f"Sharded sweep of {sweep_started} joined as {self.worker_id}, regions: {', '.join(self.scan_regions())}.")
+
+        scanned = 0
+        in_flight = {}
+        running = Counter()
+        next_renewal = time.monotonic() + self.lease_seconds / 3
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='fetcher') as executor:
+            while True:
+                free = self.workers - len(in_flight)
+                claimed = []
+                if free > 0:
+                    try:
+                        claimed = self.claim_within_caps(min(free, self.lease_batch), sweep_started, running)
+                    except Exception as e:
+                        logger.error(f"Failed to claim servers: {e}")
+                for server in claimed:
+                    in_flight[executor.submit(self.process_leased_server, server)] = server
+                    running[server['region']] += 1
+                if not in_flight:
+                    break
+
+                # Claim again at once while there is work and a free worker; otherwise wait for a
+                # scan to finish, polling now and then for leases other fetchers let expire
+                if claimed and len(in_flight) < self.workers:
+                    continue
+                timeout = max(1, min(30, next_renewal - time.monotonic()))
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    server = in_flight.pop(future)
+                    running[server['region']] -= 1
+                    scanned += 1
+                    if future.exception():
+                        logger.error(f"Worker failed on server {server['ip']}: {future.exception()}")
+
+                if time.monotonic() >= next_renewal:
+                    try:
+                        self.renew_leases([server['ip'] for server in in_flight.values()])
+                    except Exception as e:
+                        logger.error(f"Failed to renew leases: {e}")
+                    next_renewal = time.monotonic() + self.lease_seconds / 3
+        try:
+            self.finish_sweep(sweep_started)
+        except Exception as e:
+            logger.error(f"Failed to mark the sweep finished: {e}")
+        logger.info(f"Sharded sweep finished, {scanned} servers scanned by {self.worker_id}.")
+
+    def process_leased_server(self, server):
+        try:
+            self.process_server(server)
+        finally:
+            self.release_lease(server['ip'])
+
+    def find_interpreter(self, ip, ssh_client):
+        # Returns the interpreter to run the detector with (python, else python3), or None
+        if ip in self.interpreters:
+            return self.interpreters[ip]
+
+        with self.stage('interpreter_lookup', ip):
+            stdin, stdout, stderr = ssh_client.exec_command("which python 2>/dev/null || which python3", timeout=self.connect_timeout)
+            lines = stdout.read().decode('utf-8').split()
+        python_interpreter = next((line for line in lines if line.startswith('/')), None)
+        if not python_interpreter:
             logger.error("No valid Python interpreter found on the server.")
+            self.update_server_status(ip, "Failure", "No valid Python interpreter found on the server.")
             return None
+        logger.info(f"Using Python interpreter: {python_interpreter}")
+        self.interpreters[ip] = python_interpreter
+        return python_interpreter
 
+    def run_detector(self, ssh_client, command, seconds):
+        # Starts the command and feeds it the detector; `python -` runs it once stdin closes
+        stdin, stdout, stderr = ssh_client.exec_command(command, timeout=seconds)
+        stdin.write(self.script_content)
+        stdin.flush()
+        stdin.channel.shutdown_write()
+        return stdout, stderr
 
-    def get_components(self, ip, ssh_client, search_path):
-        try:
-            python_interpreter = self.get_python_interpreter(ssh_client)
+    def build_command(self, python_interpreter, search_path, use_sudo, since_token, output_format, seconds):
+        # timeout runs under sudo too, so it can kill the detector itself once the host's time is up
+        deadline = f"timeout -s KILL {math.ceil(seconds)}"
+        if use_sudo:
+            command = f"sudo {deadline} {python_interpreter} - {search_path}"
+        else:
+            command = f"{deadline} {python_interpreter} - {search_path}"
+        command += f" --format {output_format}"
+        if self.detector_workers > 1:
+            command += f" --workers {self.detector_workers}"
+        if self.versions:
+            command += " --versions"
+        if self.incremental:
+            command += f" --cache-file {self.remote_cache_path if use_sudo else self.user_cache_path}"
+            if since_token:
+                command += f" --since {since_token}"
+        return command
 
+    def get_components(self, ip, ssh_client, search_path, use_sudo=True, since_token=None):
+        # Returns (components, scan_token); components is None when there is nothing to write
+        try:
+            python_interpreter = self.find_interpreter(ip, ssh_client)
             if not python_interpreter:
-                self.update_server_status(ip, "Failure", "No valid Python interpreter found on the server.")
-                return None
-
-            with open(self.local_script_path, 'r') as script_file:
-                script_content = script_file.read()
-            
-            sftp = ssh_client.open_sftp()
-            with sftp.open(self.remote_script_path, 'w') as remote_script:
-                remote_script.write(script_content)
-            sftp.close()
-            
-            if self.use_sudo:
-                command = f"sudo {python_interpreter} {self.remote_script_path} {search_path}"
-            else:
-                command = f"{python_interpreter} {self.remote_script_path} {search_path}"
+                return None, None
 
-            stdin, stdout, stderr = ssh_client.exec_command(command)
-            result = stdout.read().decode('utf-8')
-            error = stderr.read().decode('utf-8')
+            seconds = self.time_left(ip)
+            output_format = 'compact' if self.output_format == 'compact' else 'json'
+            command = self.build_command(python_interpreter, search_path, use_sudo, since_token, output_format, seconds)
+
+            # The remote process is killed when the host's time is up, and the channel is
+            # closed a little later in case the host no longer answers at all
+            with self.stage('remote_exec', ip):
+                stdout, stderr = self.run_detector(ssh_client, command, seconds)
+                with self.exec_deadline(ip, stdout, seconds):
+                    result = stdout.read().decode('utf-8')
+                    error = stderr.read().decode('utf-8')
             # if error:
             #     logger.warning(f"Error from remote script on path {search_path}: {error}")
             #     self.update_server_status(ip, "Failure", f"Error from remote script on path {search_path}: {error}")
             #     return None
-            # Use regex to filter out JSON data
-            json_match = re.search(r'(\{.*\})', result, re.DOTALL)
-            print(json_match)
-            if json_match:
-                json_result = json_match.group(0)  # Extract the JSON part
-                print(json_result)
+            # A compact payload is one prefixed line; a host may still answer in plain JSON,
+            # which the regex filters out of anything else printed
+            compact = next((line for line in result.splitlines() if line.startswith(COMPACT_PREFIX)), None)
+            json_match = None if compact else re.search(r'(\{.*\})', result, re.DOTALL)
+            if compact or json_match:
                 try:
-                    output = json.loads(json_result)
-                except json.JSONDecodeError as e:
+                    with self.stage('parse', ip):
+                        output = decode_compact(compact) if compact else json.loads(json_match.group(0))
+                except ValueError as e:
                     logger.error(f"Failed to decode JSON output from {search_path}: {e}")
                     self.update_server_status(ip, "Failure", f"Failed to decode JSON output from {search_path}: {e}")
+                    return None, None
 
-                if output["status"] == "success":
-                    components = output["components"]
-                    if len(components) == 0:
-                        logger.warning(f"No components found on path {search_path}")
-                        self.update_server_status(ip, "Success", f"No components found on path {search_path}")
-                        return None
-                    logger.info(f"Decoded components JSON for path {search_path}: {components}")
-                    return components
-                    
-                else:
-                    error_message = output["message"]
-                    logger.error(f"Script execution failure, error : {error_message}")
-                    self.update_server_status(ip, "Failure", f"Script execution failure, error : {error_message}.")
+                return self.handle_scan_status(ip, search_path, output, since_token), output.get("token")
             else:
                 logger.warning(f"No json output from remote script for path {search_path}.")
                 self.update_server_status(ip, "Success", f"No json output from remote script for path {search_path}.")
-            return None
+            return None, None
         except Exception as e:
             logger.error(f"Failed to get components for path {search_path}: {e}")
+            self.interpreters.pop(ip, None)  # Look the interpreter up again next time
             self.update_server_status(ip, "Failure", f"Failed to get components for path {search_path}: {e}")
-            return None
-        
-    def delete_exisiting_components(self, ip, region):
+            return None, None
+
+    def handle_scan_status(self, ip, search_path, output, since_token):
+        # Records the outcome of a scan that has nothing to write; returns the components of
+        # a successful one otherwise, an empty list included, since that set replaces the old
+        scan_token = output.get("token")
+        if output["status"] == "unchanged":
+            logger.info(f"No change on path {search_path} since token {since_token}, skipping database update.")
+            self.update_server_status(ip, "Success", output["message"], scan_token=scan_token)
+        elif output["status"] == "success":
+            components = output.get("components") or []
+            if not components:
+                logger.warning(f"No components found on path {search_path}")
+            else:
+                logger.info(f"Decoded components JSON for path {search_path}: {components}")
+            return components
+        else:
+            error_message = output["message"]
+            logger.error(f"Script execution failure, error : {error_message}")
+            self.update_server_status(ip, "Failure", f"Script execution failure, error : {error_message}.")
+        return None
+
+    def stream_components(self, ip, region, ssh_client, search_path, use_sudo=True, since_token=None):
+        # Reads the detector's NDJSON output line by line while the remote scan runs, then
+        # replaces the host's rows in one transaction on a success status. The write only
+        # starts once the remote command is done, so no pooled connection or row lock is
+        # held while a slow host is still scanning
         try:
-            self.cursor.execute(
-            "DELETE FROM components WHERE ip = %s AND region = %s", 
-            (ip, region)
-            )
+            python_interpreter = self.find_interpreter(ip, ssh_client)
+            if not python_interpreter:
+                return
+
+            seconds = self.time_left(ip)
+            command = self.build_command(python_interpreter, search_path, use_sudo, since_token, 'ndjson', seconds)
+            # Parsing happens while the remote scan runs; it is timed apart and the rest
+            # of the stream is counted as remote execution
+            started = time.perf_counter()
+            timings = {'parse': 0.0, 'db_write': 0.0}
+            stdout, stderr = self.run_detector(ssh_client, command, seconds)
+
+            try:
+                components = []
+                status = None
+                with self.exec_deadline(ip, stdout, seconds):
+                    for line in stdout:
+                        line = line.strip()
+                        if not line.startswith('{'):
+                            continue  # Anything else the remote side prints
+                        tick = time.perf_counter()
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            logger.warning(f"Skipping undecodable line from {search_path} on {ip}: {line[:200]}")
+                            continue
+                        finally:
+                            timings['parse'] += time.perf_counter() - tick
+                        if record.get("type") == "component":
+                            components.append(record)
+                        elif record.get("type") == "status":
+                            status = record
+                            break
+
+                if status is None:
+                    raise RuntimeError(f"Remote scan of {search_path} ended without a status line.")
+                if status["status"] == "success":
+                    # An empty set still replaces the host's rows and rollups
+                    if not components:
+                        logger.warning(f"No components found on path {search_path}")
+                    tick = time.perf_counter()
+                    with ComponentWriter(self.db_pool, ip, region, self.catalog) as writer:
+                        for offset in range(0, len(components), self.write_batch_size):
+                            writer.write(components[offset:offset + self.write_batch_size])
+                        writer.commit(status.get("token"))
+                    timings['db_write'] += time.perf_counter() - tick
+                    self.count_result(ip, "Success")
+                    self.metrics.count('components_written', writer.row_count, region=self.host_regions.get(ip))
+                    logger.info(f"Streamed {len(components)} components for path {search_path} on {ip}.")
+                else:
+                    self.handle_scan_status(ip, search_path, status, since_token)
+            finally:
+                region = self.host_regions.get(ip, region)
+                remote_seconds = time.perf_counter() - started - timings['parse'] - timings['db_write']
+                self.metrics.observe('remote_exec', remote_seconds, region)
+                self.metrics.observe('parse', timings['parse'], region)
+                self.metrics.observe('db_write', timings['db_write'], region)
         except Exception as e:
-            logger.error(f"Error deleting components for IP {ip} in region {region}: {e}")
+            logger.error(f"Failed to get components for path {search_path}: {e}")
+            self.interpreters.pop(ip, None)  # Look the interpreter up again next time
+            self.update_server_status(ip, "Failure", f"Failed to get components for path {search_path}: {e}")
 
-    def insert_into_database(self, ip, component, region):
+    def replace_components(self, ip, region, components, scan_token=None):
+        # Delete and re-insert in a single transaction, so readers keep seeing the
+        # previous component set until the new one is committed
         try:
-            self.cursor.execute(
-                "SELECT 1 FROM components WHERE ip = %s AND component_name = %s AND region = %s", 
-                (ip, component['comp_name'], region)
-            )
-            if self.cursor.fetchone() is None:
-                self.cursor.execute(
-                    "INSERT INTO components (ip, region, component_name, platform, comp_path) VALUES (%s, %s, %s, %s, %s)",
-                    (ip, region, component['comp_name'], component['platform'], component['path'])
-                )
-                self.db_connection.commit()
-                logger.info(f"Inserted component {component['comp_name']} for IP {ip} in region {region}.")
-            else:
-                logger.info(f"Skipping duplicate entry for IP {ip}, component {component['comp_name']}, and region {region}.")
+            with self.stage('db_write', ip), ComponentWriter(self.db_pool, ip, region, self.catalog) as writer:
+                writer.write(components)
+                writer.commit(scan_token)
+            self.count_result(ip, "Success")
+            self.metrics.count('components_written', writer.row_count, region=self.host_regions.get(ip))
+            return True
         except Exception as e:
-            logger.error(f"Error inserting component {component['comp_name']} for IP {ip} in region {region}: {e}")
+            logger.error(f"Error replacing components for IP {ip} in region {region}: {e}")
+            self.update_server_status(ip, "Failure", f"Error replacing components: {e}")
+            return False
 
-    def update_server_status(self, ip, status, error_message=None):
+    def host_budget(self, server):
+        # Seconds a scan of the host may take in all: timeout_factor times its recent scan
+        # time, within min_host_timeout and host_timeout; host_timeout until it has one
+        if not server.get('scan_seconds'):
+            return self.host_timeout
+        return min(self.host_timeout, max(self.min_host_timeout, self.timeout_factor * server['scan_seconds']))
+
+    def time_left(self, ip):
+        return max(1, self.host_deadlines[ip] - time.monotonic())
+
+    @contextmanager
+    def exec_deadline(self, ip, stdout, seconds):
+        # Closes the channel once the remote command's time is up, which ends any read
+        # blocked on it; the grace period lets the remote kill come first. The block only
+        # ends in a TimeoutError when the read was really cut off, by that close or by the
+        # remote timeout killing the detector; any other error passes through unchanged
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            stdout.channel.close()
+
+        timer = threading.Timer(seconds + self.connect_timeout, expire)
+        timer.daemon = True
+        timer.start()
         try:
-            self.cursor.execute(
-                "UPDATE servers SET last_updated_time = %s, update_status = %s, error_message = %s WHERE server_ip = %s",
-                (datetime.now(), status, error_message, ip)
-            )
-            self.db_connection.commit()
+            yield
+        except Exception:
+            if not expired.is_set():
+                raise
+        finally:
+            timer.cancel()
+        if expired.is_set() or self.killed_by_timeout(stdout.channel):
+            self.metrics.count('scan_timeouts', region=self.host_regions.get(ip))
+            raise TimeoutError(f"Scan of {ip} killed after its {seconds:.0f}s deadline")
+
+    def killed_by_timeout(self, channel):
+        # timeout reports a command it killed with 124, or 137 once KILL took it down as well;
+        # the exit status follows the end of the output closely, so it is only briefly awaited
+        give_up = time.monotonic() + min(self.connect_timeout, 5)
+        while not channel.exit_status_ready() and time.monotonic() < give_up:
+            time.sleep(0.05)
+        return channel.exit_status_ready() and channel.recv_exit_status() in (124, 137)
+
+    def record_scan(self, server, seconds):
+        # Stamps last_scanned_time, whatever the outcome, and feeds the scan time into the
+        # host's adaptive timeout. The circuit breaker trips after park_after consecutive
+        # failures: the host is parked for park_base seconds, doubling with every further
+        # failure up to park_max. A failure never lowers the scan time, so a host that
+        # outgrew its timeout gets a longer one next time
+        ip = server['ip']
+        status = self.scan_results.pop(ip, None)
+        if status is None:
+            try:
+                with self.db_pool.transaction() as cursor:
+                    cursor.execute("UPDATE servers SET last_scanned_time = NOW() WHERE server_ip = %s", (ip,))
+            except Exception as e:
+                logger.error(f"Failed to record the scan of {ip}: {e}")
+            return
+        previous = server.get('scan_seconds')
+        if status == 'Success':
+            scan_seconds = seconds if previous is None else 0.7 * previous + 0.3 * seconds
+            failures, delay = 0, None
+        else:
+            scan_seconds = max(previous or 0, seconds)
+            failures = server.get('consecutive_failures', 0) + 1
+            delay = None
+            if failures >= self.park_after:
+                delay = min(self.park_base * 2 ** (failures - self.park_after), self.park_max)
+        try:
+            with self.db_pool.transaction() as cursor:
+                if delay:
+                    cursor.execute(
+                        "UPDATE servers SET last_scanned_time = NOW(), scan_seconds = %s, consecutive_failures = %s, "
+                        "parked_until = NOW() + INTERVAL %s SECOND, update_status = 'Parked' WHERE server_ip = %s",
+                        (scan_seconds, failures, delay, ip)
+                    )
+                else:
+                    cursor.execute(
+                        "UPDATE servers SET last_scanned_time = NOW(), scan_seconds = %s, consecutive_failures = %s, "
+                        "parked_until = NULL WHERE server_ip = %s",
+                        (scan_seconds, failures, ip)
+                    )
+        except Exception as e:
+            logger.error(f"Failed to record the scan time of {ip}: {e}")
+            return
+        if delay:
+            self.metrics.count('hosts_parked', region=self.host_regions.get(ip))
+            logger.warning(f"Parked {ip} for {delay}s after {failures} consecutive failures.")
+
+    def stage(self, stage, ip):
+        # Times a stage of the scan of ip, labelled with the region it is being scanned in
+        return self.metrics.time(stage, self.host_regions.get(ip))
+
+    def count_result(self, ip, status):
+        self.scan_results[ip] = status
+        self.metrics.count('scan_results', region=self.host_regions.get(ip), status=status)
+
+    def export_metrics(self):
+        if self.metrics_textfile:
+            try:
+                self.metrics.write_textfile(self.metrics_textfile)
+            except OSError as e:
+                logger.error(f"Failed to write metrics to {self.metrics_textfile}: {e}")
+
+    def update_server_status(self, ip, status, error_message=None, scan_token=None):
+        self.count_result(ip, status)
+        try:
+            with self.db_pool.transaction() as cursor:
+                cursor.execute(
+                    "UPDATE servers SET last_updated_time = NOW(), update_status = %s, error_message = %s WHERE server_ip = %s",
+                    (status, error_message, ip)
+                )
+                if scan_token:
+                    cursor.execute("UPDATE servers SET scan_token = %s WHERE server_ip = %s", (scan_token, ip))
+                if status == "Success":
+                    # An unchanged host was still seen with its components
+                    cursor.execute("UPDATE hosts SET last_seen = NOW() WHERE ip = %s AND first_seen IS NOT NULL", (ip,))
             logger.info(f"Updated last_updated_time, update_status, and error_message for IP {ip} to '{status}'.")
         except Exception as e:
             logger.error(f"Failed to update server status for IP {ip}: {e}")
 
     def ssh_connection(self, ip, user, key_path):
-        ssh_client = paramiko.SSHClient()
-        ssh_client.load_system_host_keys()
-        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         try:
-            ssh_client.connect(hostname=ip, username=user, key_filename=key_path)
+            ssh_client = self.ssh_pool.acquire(ip, user, key_path)
             logger.info(f"Connected to {ip} with user {user}.")
             return ssh_client, user
         except Exception as e:
@@ -204,20 +653,26 @@ class ComponentFetcher:
         # Determine key path based on AWS or datacenter
         if self.regions:
             if region in self.regions:
-                self.use_sudo = True
                 return self.regions[region]['key_path']
         if self.datacenters:
             if region in self.datacenters:
-                self.use_sudo = False
                 return self.datacenters[region]['key_path']
         else:
             return None
 
+    def requires_sudo(self, region):
+        # AWS hosts run the detector through sudo, datacenter hosts use their own user
+        return bool(self.regions) and region in self.regions
+
+    def region_limit(self, region):
+        limit = self.region_limits.get(region, self.region_concurrency)
+        return max(1, int(limit)) if limit else self.workers
+
     def fetch_and_store_components(self):
         # Fetch only failure instances first
         servers = self.get_valid_servers()
-        failure_instances = [server for server in servers if server.get('update_status') == 'Failure']
-        success_instances = [server for server in servers if server.get('update_status') != 'Failure']
+        failure_instances = [server for server in servers if server.get('update_status') in ('Failure', 'Parked')]
+        success_instances = [server for server in servers if server.get('update_status') not in ('Failure', 'Parked')]
 
         # Process failure instances first
         logger.info("Processing failure instances first...")
@@ -232,46 +687,135 @@ class ComponentFetcher:
             logger.info("User chose not to proceed with success instances.")
 
     def process_servers(self, servers):
+        if self.workers == 1:
+            for server in servers:
+                self.process_server(server)
+            return
+
+        # Queue servers per region, keeping the priority order within each region
+        pending = OrderedDict()
         for server in servers:
-            ip = server['ip']
-            user = server['user']
-            region = server['region']
-            
-            key_path = self.key_finder(region)
-            if key_path is None:
-                logger.warning(f"No key path found for region {region}. Skipping server {ip}.")
-                self.update_server_status(ip, "Failure", "Missing key path")
-                continue
+            pending.setdefault(server['region'], deque()).append(server)
+
+        in_flight = {}
+        running = Counter()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='fetcher') as executor:
+            while pending or in_flight:
+                # Hand out free workers round-robin across regions that are still under their cap,
+                # so a slow region only ever holds its own share of the pool
+                dispatched = True
+                while dispatched and len(in_flight) < self.workers:
+                    dispatched = False
+                    for region in list(pending):
+                        if len(in_flight) >= self.workers:
+                            break
+                        if running[region] >= self.region_limit(region):
+                            continue
+                        server = pending[region].popleft()
+                        if not pending[region]:
+                            del pending[region]
+                        in_flight[executor.submit(self.process_server, server)] = server
+                        running[region] += 1
+                        dispatched = True
+
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    server = in_flight.pop(future)
+                    running[server['region']] -= 1
+                    if future.exception():
+                        logger.error(f"Worker failed on server {server['ip']}: {future.exception()}")
 
+    def scan_server(self, server):
+        ip = server['ip']
+        user = server['user']
+        region = server['region']
+
+        self.host_regions[ip] = region
+        started = time.perf_counter()
+        key_path = self.key_finder(region)
+        if key_path is None:
+            logger.warning(f"No key path found for region {region}. Skipping server {ip}.")
+            self.update_server_status(ip, "Failure", "Missing key path")
+            return
+
+        with self.stage('ssh_connect', ip):
             ssh_client, user = self.ssh_connection(ip, user, key_path)
-            if ssh_client is None:
-                logger.warning(f"Failed to connect to {ip}. Moving to the next server.")
-                continue
+        if ssh_client is None:
+            logger.warning(f"Failed to connect to {ip}. Moving to the next server.")
+            return
 
-            try:
-                search_path = server['search_path']
-                components = self.get_components(ip, ssh_client, search_path)
-                if components:
-                    self.delete_exisiting_components(ip, region)
-                    for component in components:
-                        self.insert_into_database(ip, component, region)
-                    
-            except Exception as e:
-                logger.error(f"Failed to fetch components from {ip}: {e}")
-            finally:
-                ssh_client.close()
-                logger.info(f"SSH connection closed for server {ip}.")
+        try:
+            search_path = server['search_path']
+            if self.output_format == 'ndjson':
+                self.stream_components(
+                    ip, region, ssh_client, search_path, self.requires_sudo(region), since_token=server.get('scan_token')
+                )
+            else:
+                components, scan_token = self.get_components(
+                    ip, ssh_client, search_path, self.requires_sudo(region), since_token=server.get('scan_token')
+                )
+                if components is not None:
+                    self.replace_components(ip, region, components, scan_token)
+
+        except Exception as e:
+            logger.error(f"Failed to fetch components from {ip}: {e}")
+            self.update_server_status(ip, "Failure", f"Failed to fetch components from {ip}: {e}")
+        finally:
+            self.ssh_pool.release(ip, user, key_path)
+            self.metrics.observe('scan', time.perf_counter() - started, region)
+            logger.info(f"SSH connection released for server {ip}.")
+
+    def process_server(self, server):
+        # Scans the host within its deadline, then records how long that took and how it went
+        started = time.monotonic()
+        self.host_deadlines[server['ip']] = started + self.host_budget(server)
+        self.scan_results.pop(server['ip'], None)
+        try:
+            self.scan_server(server)
+        finally:
+            self.record_scan(server, time.monotonic() - started)
 
     def close(self):
+        if self.owns_ssh_pool:
+            self.ssh_pool.close()
         try:
-            self.db_connection.close()
+            self.db_pool.close()
+            self.catalog.close()
             logger.info("Database connection closed.")
         except Exception as e:
             logger.error(f"Failed to close database connection: {e}")
 
 if __name__ == "__main__":
-    config_path = './config/config.yaml'  # Path to your JSON configuration file
-    
-    fetcher = ComponentFetcher(config_path)
-    fetcher.fetch_and_store_components()
-    fetcher.close()
+    parser = argparse.ArgumentParser(description="Fetch components from all valid servers.")
+    parser.add_argument('--config', default='./config/config.yaml', help='Path to the YAML configuration file')
+    parser.add_argument('--workers', type=int, help='Number of servers scanned concurrently (overrides fetcher.workers)')
+    parser.add_argument('--discover', action='store_true', help='Update the servers table first, reusing its SSH connections for the scan')
+    parser.add_argument('--daemon', action='store_true', help='Keep running, rescanning each host as it goes stale or its retry comes due')
+    parser.add_argument('--sharded', action='store_true', help='Share the sweep with other fetchers, claiming servers through leases in the servers table')
+    parser.add_argument('--regions', nargs='+', help='Only scan servers in these regions or datacenters')
+    args = parser.parse_args()
+
+    # The fetcher's SSH pool, built with its connect_timeout and ssh_idle_ttl, is shared with discovery
+    metrics = MetricsRegistry()
+    fetcher = ComponentFetcher(args.config, workers=args.workers, metrics=metrics)
+    if args.discover:
+        manager = ServerDetailsManager(args.config, os.path.dirname(os.path.realpath(__file__)), ssh_pool=fetcher.ssh_pool, metrics=metrics)
+        manager.update_servers_table()
+        manager.close()
+
+    fetcher.shard_regions = args.regions
+    if fetcher.metrics_port:
+        metrics.serve(fetcher.metrics_port)
+    try:
+        if args.daemon:
+            ComponentScheduler(args.config, fetcher).run_forever()
+        elif args.sharded:
+            fetcher.process_sharded()
+        else:
+            fetcher.fetch_and_store_components()
+    finally:
+        fetcher.export_metrics()
+        logger.info(f"Run summary written to {metrics.write_summary(fetcher.metrics_summary_dir, 'fetch')}")
+        fetcher.close()
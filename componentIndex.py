@@ -0,0 +1,221 @@
+import bisect
+import heapq
+import ipaddress
+import threading
+from collections import defaultdict
+
+# Column order of a components row, as selected by the searcher
+FIELDS = ('region', 'ip', 'component_name', 'platform', 'comp_path')
+FIELD_ALIASES = {
+    'region': 'region',
+    'ip': 'ip',
+    'name': 'component_name',
+    'component': 'component_name',
+    'platform': 'platform',
+    'path': 'comp_path',
+}
+SUBSTRING_FIELDS = ('ip', 'component_name', 'comp_path')
+EXACT_FIELDS = ('region', 'platform')
+DEFAULT_FIELDS = ('component_name', 'ip')
+
+def row_key(row):
+    # Results are ordered by region, ip and component name, then platform and path.
+    # ComponentWriter stores a name once per host, so a row is also the position a
+    # following page resumes from
+    return tuple(value or '' for value in row)
+
+class ComponentIndex:
+    def __init__(self):
+        # Rows are stored once; every index below works on the distinct values of a
+        # field (a few hundred names and platforms, one ip per host) and maps each
+        # value to the ids of the rows holding it
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.rows = []
+        self.postings = {field: defaultdict(list) for field in FIELDS}
+        self.trigrams = {field: defaultdict(set) for field in SUBSTRING_FIELDS}
+        self.host_rows = defaultdict(list)
+        self.removed = 0
+        self.sorted_values = {}
+        self.ip_numbers = None
+        self.ranks = None
+        self.sorted_keys = None
+
+    def __len__(self):
+        return len(self.rows) - self.removed
+
+    def live_rows(self):
+        with self.lock:
+            return [row for row in self.rows if row is not None]
+
+    def add_rows(self, rows):
+        with self.lock:
+            new_values = False
+            for row in rows:
+                row_id = len(self.rows)
+                self.rows.append(tuple(row))
+                self.host_rows[row[1]].append(row_id)
+                for position, field in enumerate(FIELDS):
+                    value = (row[position] or '').lower()
+                    postings = self.postings[field]
+                    if value not in postings:
+                        new_values = True
+                        if field in self.trigrams:
+                            for trigram in self.value_trigrams(value):
+                                self.trigrams[field][trigram].add(value)
+                    postings[value].append(row_id)
+            if new_values:
+                self.sorted_values = {}
+                self.ip_numbers = None
+
+    def replace_hosts(self, ips, rows):
+        # Removed rows are only tombstoned; once they make up half the index it is rebuilt
+        with self.lock:
+            for ip in ips:
+                for row_id in self.host_rows.pop(ip, ()):
+                    self.rows[row_id] = None
+                    self.removed += 1
+            self.add_rows(rows)
+            if self.removed > len(self.rows) // 2:
+                live = [row for row in self.rows if row is not None]
+                self.reset()
+                self.add_rows(live)
+
+    def prepare(self):
+        # Position of each row in row_key order, so results can be ordered by an integer
+        # lookup. Sorted outside the lock; searches fall back to sorting by the row
+        # itself until the ranks cover every row
+        with self.lock:
+            keys = [row_key(row) if row is not None else () for row in self.rows]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        ranks = [0] * len(keys)
+        for rank, row_id in enumerate(order):
+            ranks[row_id] = rank
+        sorted_keys = [keys[row_id] for row_id in order]
+        with self.lock:
+            if len(self.rows) == len(ranks):
+                self.ranks = ranks
+                self.sorted_keys = sorted_keys
+
+    def value_trigrams(self, value):
+        return {value[i:i + 3] for i in range(len(value) - 2)}
+
+    def field_values(self, field):
+        if field not in self.sorted_values:
+            self.sorted_values[field] = sorted(self.postings[field])
+        return self.sorted_values[field]
+
+    def rows_for_values(self, field, values):
+        postings = self.postings[field]
+        row_ids = set()
+        for value in values:
+            row_ids.update(postings.get(value, ()))
+        return row_ids
+
+    def match_substring(self, field, term):
+        if len(term) >= 3 and field in self.trigrams:
+            candidates = None
+            for trigram in self.value_trigrams(term):
+                values = self.trigrams[field].get(trigram, set())
+                candidates = values if candidates is None else candidates & values
+                if not candidates:
+                    return set()
+        else:
+            candidates = self.postings[field]
+        return self.rows_for_values(field, [value for value in candidates if term in value])
+
+    def match_prefix(self, field, prefix):
+        values = self.field_values(field)
+        start = bisect.bisect_left(values, prefix)
+        end = bisect.bisect_left(values, prefix + '\uffff')
+        return self.rows_for_values(field, values[start:end])
+
+    def match_exact(self, field, value):
+        return set(self.postings[field].get(value, ()))
+
+    def match_network(self, network):
+        if self.ip_numbers is None:
+            numbers = []
+            for ip in self.postings['ip']:
+                try:
+                    numbers.append((int(ipaddress.ip_address(ip)), ip))
+                except ValueError:
+                    continue
+            self.ip_numbers = sorted(numbers)
+        start = bisect.bisect_left(self.ip_numbers, (int(network.network_address), ''))
+        end = bisect.bisect_right(self.ip_numbers, (int(network.broadcast_address), '\uffff'))
+        return self.rows_for_values('ip', [ip for _, ip in self.ip_numbers[start:end]])
+
+    def parse_query(self, query):
+        # Whitespace separated terms, all of which must match. A term is either bare
+        # (component name or ip) or field-qualified as field:value. A trailing * makes
+        # it a prefix match and an address with a /mask a CIDR match on the ip
+        terms = []
+        for token in query.split():
+            field, separator, value = token.partition(':')
+            if separator and field.lower() in FIELD_ALIASES and value:
+                fields = (FIELD_ALIASES[field.lower()],)
+            else:
+                fields, value = DEFAULT_FIELDS, token
+            terms.append((fields, value.lower()))
+        return terms
+
+    def match_term(self, fields, value):
+        if '/' in value and 'ip' in fields:
+            try:
+                return self.match_network(ipaddress.ip_network(value, strict=False))
+            except ValueError:
+                pass
+        row_ids = set()
+        for field in fields:
+            if value.endswith('*'):
+                row_ids |= self.match_prefix(field, value.rstrip('*'))
+            elif field in EXACT_FIELDS:
+                row_ids |= self.match_exact(field, value)
+            else:
+                row_ids |= self.match_substring(field, value)
+        return row_ids
+
+    def matching_ids(self, terms):
+        row_ids = range(len(self.rows)) if not terms else None
+        for fields, value in terms:
+            matches = self.match_term(fields, value)
+            row_ids = matches if row_ids is None else row_ids & matches
+            if not row_ids:
+                return []
+        return [row_id for row_id in row_ids if self.rows[row_id] is not None]
+
+    def row_order(self):
+        # Sort key for row ids: the precomputed rank, or the row itself while ranks are stale
+        if self.ranks is not None and len(self.ranks) == len(self.rows):
+            return self.ranks.__getitem__
+        return lambda row_id: row_key(self.rows[row_id])
+
+    def search(self, query):
+        # Returns matching rows in row_key order
+        terms = self.parse_query(query)
+        with self.lock:
+            live = self.matching_ids(terms)
+            live.sort(key=self.row_order())
+            return [self.rows[row_id] for row_id in live]
+
+    def search_page(self, query, limit, after=None, offset=0):
+        # One page of search(): the first limit matches ordered after the row after,
+        # skipping offset of them. Only the rows of the page are
+        # ordered, so the first page of a search matching most of the index is as quick
+        # as a narrow one. Returns the page and the number of matches in total
+        terms = self.parse_query(query)
+        with self.lock:
+            live = self.matching_ids(terms)
+            total = len(live)
+            if after is not None:
+                after = row_key(after)
+                if self.ranks is not None and len(self.ranks) == len(self.rows):
+                    first_rank = bisect.bisect_right(self.sorted_keys, after)
+                    live = [row_id for row_id in live if self.ranks[row_id] >= first_rank]
+                else:
+                    live = [row_id for row_id in live if row_key(self.rows[row_id]) > after]
+            page = heapq.nsmallest(offset + limit, live, key=self.row_order())[offset:]
+            return [self.rows[row_id] for row_id in page], total
@@ -0,0 +1,192 @@
+import heapq
+import random
+import signal
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+import yaml
+from loguru import logger
+
+class ComponentScheduler:
+    def __init__(self, config_file, fetcher):
+        with open(config_file, 'r') as file:
+            config = yaml.safe_load(file)
+
+        # Every host is rescanned within its region's freshness SLA; failed hosts are
+        # retried after an exponential backoff instead, and parked hosts once unparked
+        scheduler_config = config.get('scheduler') or {}
+        self.freshness_sla = scheduler_config.get('freshness_sla', 86400)
+        self.region_sla = scheduler_config.get('region_sla') or {}
+        self.retry_base = scheduler_config.get('retry_base', 300)
+        self.retry_max = scheduler_config.get('retry_max', 21600)
+        self.reload_interval = scheduler_config.get('reload_interval', 300)
+
+        self.fetcher = fetcher
+        self.servers = {}
+        self.region_hosts = Counter()
+        self.queue = []
+        self.due = {}
+        self.next_slot = {}
+        self.in_flight = {}
+        self.stopped = threading.Event()
+        # Seconds added to a database timestamp to make it this host's epoch time
+        self.clock_offset = 0.0
+
+    def region_sla_seconds(self, region):
+        return self.region_sla.get(region, self.freshness_sla)
+
+    def backoff(self, failures):
+        # retry_base, doubling with every consecutive failure up to retry_max, with
+        # some jitter so hosts failing together do not retry together
+        delay = min(self.retry_base * 2 ** max(0, failures - 1), self.retry_max)
+        return delay * random.uniform(0.8, 1.2)
+
+    def sync_clock(self):
+        # Scan times and parked_until come from the database's NOW(), in its session time
+        # zone and by its clock; the offset from this host's clock is taken once per reload
+        try:
+            with self.fetcher.db_pool.transaction() as cursor:
+                cursor.execute("SELECT NOW()")
+                database_now = cursor.fetchone()[0]
+            self.clock_offset = time.time() - database_now.timestamp()
+        except Exception as e:
+            logger.error(f"Failed to read the database clock, keeping an offset of {self.clock_offset:.0f}s: {e}")
+
+    def epoch(self, timestamp):
+        return timestamp.timestamp() + self.clock_offset
+
+    def due_time(self, server):
+        # Epoch seconds at which the host should be scanned next. Only the fetcher writes
+        # last_scanned_time, so a host discovery has just added is due at once, and a
+        # failed host keeps its backoff when discovery probes it again
+        last_scanned = server.get('last_scanned_time')
+        if last_scanned is None:
+            return time.time()
+        last_scan = self.epoch(last_scanned)
+        if server.get('parked_until'):
+            return max(last_scan, self.epoch(server['parked_until']))
+        if server.get('consecutive_failures'):
+            return last_scan + self.backoff(server['consecutive_failures'])
+        return last_scan + self.region_sla_seconds(server['region'])
+
+    def schedule(self, server):
+        ip = server['ip']
+        self.servers[ip] = server
+        self.due[ip] = self.due_time(server)
+        # Failed hosts go first among hosts due at the same time
+        heapq.heappush(self.queue, (self.due[ip], 0 if server.get('consecutive_failures') else 1, ip))
+
+    def reload(self):
+        # Rebuilds the queue from the servers table, picking up new, changed and removed hosts
+        self.sync_clock()
+        servers = self.fetcher.get_valid_servers()
+        if not servers and self.servers:
+            logger.warning("No valid servers returned, keeping the current schedule.")
+            return
+        self.servers, self.queue, self.due = {}, [], {}
+        self.region_hosts = Counter(server['region'] for server in servers)
+        for server in servers:
+            if server['ip'] not in self.in_flight:
+                self.schedule(server)
+        logger.info(f"Scheduler loaded {len(servers)} servers, {sum(1 for due in self.due.values() if due <= time.time())} due now.")
+
+    def region_pace(self, region):
+        # Seconds between two scans of the region, so a full pass takes the whole SLA
+        return self.region_sla_seconds(region) / max(1, self.region_hosts[region])
+
+    def next_due(self, running):
+        # Pops the most overdue host whose region has a free worker and whose pacing slot
+        # has come; hosts held back by their region are pushed back unchanged
+        now = time.time()
+        held = []
+        server = None
+        while self.queue and self.queue[0][0] <= now:
+            entry = heapq.heappop(self.queue)
+            ip = entry[2]
+            if self.due.get(ip) != entry[0] or ip in self.in_flight:
+                continue  # Superseded by a later schedule() of the same host
+            region = self.servers[ip]['region']
+            if running[region] >= self.fetcher.region_limit(region) or self.next_slot.get(region, 0) > now:
+                held.append(entry)
+                continue
+            server = self.servers[ip]
+            self.next_slot[region] = max(now, self.next_slot.get(region, 0)) + self.region_pace(region)
+            break
+        for entry in held:
+            heapq.heappush(self.queue, entry)
+        return server
+
+    def complete(self, server, error=None):
+        # Reads back the status the fetcher recorded and schedules the host again from it;
+        # without one the failure is stamped with the current time in database terms
+        ip = server['ip']
+        server = dict(
+            server, update_status='Failure', last_scanned_time=datetime.fromtimestamp(time.time() - self.clock_offset),
+            consecutive_failures=server.get('consecutive_failures', 0) + 1
+        )
+        if error is None:
+            try:
+                with self.fetcher.db_pool.transaction() as cursor:
+                    cursor.execute(
+                        "SELECT update_status, last_scanned_time, scan_seconds, consecutive_failures, parked_until FROM servers WHERE server_ip = %s",
+                        (ip,)
+                    )
+                    row = cursor.fetchone()
+                if row:
+                    server.update(zip(('update_status', 'last_scanned_time', 'scan_seconds', 'consecutive_failures', 'parked_until'), row))
+            except Exception as e:
+                logger.error(f"Failed to read back the status of {ip}: {e}")
+        else:
+            logger.error(f"Worker failed on server {ip}: {error}")
+
+        status = server['update_status']
+        self.schedule(server)
+        logger.info(f"Next scan of {ip} ({status}) at {datetime.fromtimestamp(self.due[ip]):%Y-%m-%d %H:%M:%S}.")
+
+    def run(self):
+        # Scans hosts as they come due until stop() is called, at most fetcher.workers at a
+        # time; running scans are finished before returning
+        executor = ThreadPoolExecutor(max_workers=self.fetcher.workers, thread_name_prefix='scheduler')
+        running = Counter()
+        next_reload = 0
+        try:
+            while not self.stopped.is_set():
+                if time.time() >= next_reload:
+                    self.fetcher.export_metrics()
+                    self.reload()
+                    next_reload = time.time() + self.reload_interval
+
+                while len(self.in_flight) < self.fetcher.workers:
+                    server = self.next_due(running)
+                    if server is None:
+                        break
+                    self.in_flight[server['ip']] = (executor.submit(self.fetcher.process_server, server), server)
+                    running[server['region']] += 1
+
+                # Sleep until a scan finishes, the next host is due or the reload, whichever is first
+                wake = min([next_reload] + [entry[0] for entry in self.queue[:1]])
+                timeout = min(max(1, wake - time.time()), 60)
+                if self.in_flight:
+                    done, _ = wait([future for future, _ in self.in_flight.values()], timeout=timeout, return_when=FIRST_COMPLETED)
+                else:
+                    done = set()
+                    self.stopped.wait(timeout)
+                for ip, (future, server) in list(self.in_flight.items()):
+                    if future in done:
+                        del self.in_flight[ip]
+                        running[server['region']] -= 1
+                        self.complete(server, future.exception())
+        finally:
+            logger.info(f"Scheduler stopping, waiting for {len(self.in_flight)} running scans.")
+            executor.shutdown(wait=True)
+
+    def stop(self, *args):
+        self.stopped.set()
+
+    def run_forever(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.run()
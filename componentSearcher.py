@@ -1,68 +1,493 @@
+import os
+import sys
+import json
+import pickle
+import argparse
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
 import mysql.connector
+import yaml
 from prettytable import PrettyTable
 
+from componentIndex import ComponentIndex, FIELDS
+from metricsRegistry import MetricsRegistry
+
+# Reports read from the rollup tables the fetcher maintains: columns, query and the column
+# that report arguments select on. Their size follows the numbers of components,
+# platforms and regions, not the size of the fleet
+REPORTS = {
+    'components': (
+        ('component_name', 'platform', 'region', 'hosts'),
+        "SELECT cc.component_name, p.name, r.region, r.host_count FROM component_region_counts r "
+        "JOIN component_catalog cc ON cc.component_id = r.component_id JOIN platforms p ON p.platform_id = cc.platform_id "
+        "WHERE r.host_count > 0",
+        'cc.component_name',
+    ),
+    'platforms': (
+        ('platform', 'region', 'hosts'),
+        "SELECT p.name, r.region, r.host_count FROM platform_region_counts r JOIN platforms p ON p.platform_id = r.platform_id "
+        "WHERE r.host_count > 0",
+        'p.name',
+    ),
+    'regions': (
+        ('region', 'hosts', 'components'),
+        "SELECT region, host_count, component_count FROM region_counts WHERE host_count > 0",
+        'region',
+    ),
+    'hosts': (
+        ('ip', 'region', 'components', 'first_seen', 'last_seen'),
+        "SELECT ip, region, component_count, first_seen, last_seen FROM hosts WHERE first_seen IS NOT NULL",
+        'ip',
+    ),
+}
+
+# Stored in the snapshot; bump it whenever the snapshot's keys or its rows change shape,
+# so an older snapshot is rebuilt from the database instead of loaded
+SNAPSHOT_VERSION = 2
+
 class RemoteDatabaseSearcher:
-    def __init__(self, db_config):
+    def __init__(self, db_config, snapshot_path=None, refresh_interval=60, fresh=False, cache_size=1024, connect=None):
         self.db_config = db_config
+        self.connect_database = connect or mysql.connector.connect
         self.connection = None
         self.cursor = None
+        self.index = ComponentIndex()
+        self.loaded = False  # Only a loaded index may be saved over the snapshot
+
+        # Local snapshot of the components table, kept current from servers.last_updated_time
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = refresh_interval
+        self.fresh = fresh
+        self.watermark = None
+        self.host_versions = {}
+        self.refresh_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.refresher = None
+        self.shown = 0
 
-    def connect(self):
+        # Encoded API responses of recent searches; a generation bump on every index
+        # change makes older entries unreachable, and they age out of the LRU
+        self.cache_size = cache_size
+        self.result_cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.generation = 0
+        self.metrics = MetricsRegistry()
+
+    def connect(self, background=True):
         # Establish the MySQL database connection
-        self.connection = mysql.connector.connect(**self.db_config)
+        self.connection = self.connect_database(**self.db_config)
+        self.connection.autocommit = True  # Every refresh must see the latest committed rows
         self.cursor = self.connection.cursor()
+        if not self.load_snapshot():
+            self.load_index()
+            self.save_snapshot()
+        if background and not self.fresh:
+            self.refresher = threading.Thread(target=self.refresh_loop, name='snapshot-refresh', daemon=True)
+            self.refresher.start()
+
+    def load_index(self):
+        # Read the components table once into an in-memory n-gram index; searches then
+        # never scan the table (a leading-wildcard LIKE cannot use a MySQL index)
+        with self.refresh_lock:
+            # Taken before the rows, so hosts written during the load are picked up by the next refresh
+            self.host_versions = self.fetch_host_versions()
+            self.watermark = max(self.host_versions.values(), default=None)
+
+            index = ComponentIndex()
+            index.add_rows(self.read_components())
+            index.prepare()
+            self.index = index
+            self.loaded = True
+            self.generation += 1
+
+    def load_snapshot(self):
+        # Any snapshot that cannot be loaded as it stands, whatever the reason, means "rebuild"
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, 'rb') as snapshot_file:
+                snapshot = pickle.load(snapshot_file)
+            if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+                print(f"Ignoring snapshot {self.snapshot_path} in an older format", file=sys.stderr)
+                return False
+            index = ComponentIndex()
+            index.add_rows(snapshot['rows'])
+            index.prepare()
+            watermark, host_versions = snapshot['watermark'], dict(snapshot['host_versions'])
+        except Exception as e:
+            print(f"Ignoring unreadable snapshot {self.snapshot_path}: {e}", file=sys.stderr)
+            return False
+        self.index = index
+        self.loaded = True
+        self.generation += 1
+        self.watermark = watermark
+        self.host_versions = host_versions
+        return True
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_path)), exist_ok=True)
+        snapshot = {
+            'version': SNAPSHOT_VERSION, 'watermark': self.watermark, 'host_versions': self.host_versions,
+            'rows': self.index.live_rows()
+        }
+        temp_path = f"{self.snapshot_path}.tmp"
+        with open(temp_path, 'wb') as snapshot_file:
+            pickle.dump(snapshot, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.snapshot_path)
+
+    def read_components(self, ips=None):
+        # Returns the (region, ip, component_name, platform, comp_path) rows of every host,
+        # or only of ips. Only integer keys and paths are read per row; names come from the
+        # small host and catalog tables, read afterwards so they hold every key the rows
+        # refer to (the fetcher commits new keys before rows using them)
+        if ips is None:
+            queries = [("SELECT host_id, component_id, comp_path FROM host_components", ())]
+        else:
+            queries = [
+                (
+                    "SELECT host_id, component_id, comp_path FROM host_components "
+                    f"WHERE host_id IN (SELECT host_id FROM hosts WHERE ip IN ({', '.join(['%s'] * len(chunk))}))",
+                    tuple(chunk)
+                )
+                for chunk in (ips[start:start + 500] for start in range(0, len(ips), 500))
+            ]
+        keyed_rows = []
+        for query, params in queries:
+            self.cursor.execute(query, params)
+            while True:
+                rows = self.cursor.fetchmany(10000)
+                if not rows:
+                    break
+                keyed_rows.extend(rows)
+
+        self.cursor.execute("SELECT host_id, region, ip FROM hosts")
+        hosts = {host_id: (region, ip) for host_id, region, ip in self.cursor.fetchall()}
+        self.cursor.execute(
+            "SELECT c.component_id, c.component_name, p.name FROM component_catalog c JOIN platforms p ON p.platform_id = c.platform_id"
+        )
+        catalog = {component_id: (name, platform) for component_id, name, platform in self.cursor.fetchall()}
+        return [hosts[host_id] + catalog[component_id] + (comp_path,) for host_id, component_id, comp_path in keyed_rows]
+
+    def fetch_host_versions(self, since=None):
+        if since is None:
+            self.cursor.execute("SELECT server_ip, last_updated_time FROM servers WHERE last_updated_time IS NOT NULL")
+        else:
+            self.cursor.execute("SELECT server_ip, last_updated_time FROM servers WHERE last_updated_time >= %s", (since,))
+        return dict(self.cursor.fetchall())
+
+    def refresh(self):
+        # Re-reads the components of hosts updated since the watermark. The window
+        # overlaps a few minutes, since a fetcher worker may commit a host with a
+        # timestamp older than one already seen; host_versions skips repeats
+        with self.refresh_lock:
+            versions = self.fetch_host_versions(self.watermark - timedelta(minutes=5) if self.watermark else None)
+            changed = [ip for ip, updated in versions.items() if self.host_versions.get(ip) != updated]
+            self.metrics.count('snapshot_refreshed_hosts', len(changed))
+            if not changed:
+                return 0
+
+            self.index.replace_hosts(changed, self.read_components(changed))
+            self.generation += 1
+            self.host_versions.update(versions)
+            self.watermark = max([self.watermark or datetime.min] + list(versions.values()))
+        self.index.prepare()
+        return len(changed)
+
+    def refresh_loop(self):
+        # Catches up right away (the snapshot may be old), then every refresh_interval seconds
+        while True:
+            try:
+                if self.refresh():
+                    self.save_snapshot()
+            except Exception as e:
+                print(f"Background snapshot refresh failed: {e}", file=sys.stderr)
+            if self.stopped.wait(self.refresh_interval):
+                break
+
+    def find(self, partial_value, limit=None, offset=0, after=None):
+        # Returns one page of matching rows (every match without a limit) and the number of matches
+        if self.fresh:
+            self.refresh()
+        return self.lookup(partial_value, limit, offset, after)
+
+    def lookup(self, partial_value, limit=None, offset=0, after=None):
+        # find() on the index as it stands
+        with self.metrics.time('search'):
+            if limit:
+                return self.index.search_page(partial_value, limit, after, offset)
+            results = self.index.search(partial_value)
+            return results[offset:], len(results)
 
-    def search_by_name_or_ip(self, partial_value):
-        # Prepare and execute the SQL query to search for components by component name or IP address
-        query = """
-        SELECT region, ip, component_name, platform, comp_path 
-        FROM components 
-        WHERE component_name LIKE %s OR ip LIKE %s 
-        ORDER BY region, ip, component_name
-        """
-        self.cursor.execute(query, (f"%{partial_value}%", f"%{partial_value}%"))
-        results = self.cursor.fetchall()
+    def search_by_name_or_ip(self, partial_value, limit=None, offset=0, after=None, output_format='table', out=sys.stdout):
+        # Search terms: part of a component name or IP, a prefix ending in *, a CIDR range
+        # like 10.1.0.0/16, or a field-qualified term such as platform:Java region:us-east-1.
+        # With a limit only one page is rendered; its last row is returned while more
+        # remain, to be passed back as after for the next page
+        results, total = self.find(partial_value, limit, offset, after)
 
         # Process and display results
-        if results:
+        if not results:
+            if after is None:
+                print(f"No components or IPs found with '{partial_value}'.", file=self.status_stream(output_format, out))
+            return None
+        self.render(results, output_format, out, header=after is None)
+
+        # Matches shown so far, counting any skipped by offset, for the page footer
+        first = (self.shown if after is not None else offset) + 1
+        self.shown = first + len(results) - 1
+        if self.shown < total:
+            print(f"Rows {first}-{self.shown} of {total}. Enter ':n' for the next page.",
+                  file=self.status_stream(output_format, out))
+            return results[-1]
+        return None
+
+    def status_stream(self, output_format, out):
+        # Keeps messages out of TSV and NDJSON output so it can be piped into other tools
+        return out if output_format == 'table' else sys.stderr
+
+    def search_many(self, patterns, limit=None, offset=0, output_format='table', out=sys.stdout):
+        # Batch mode: every pattern is answered from the one index loaded at startup, each
+        # output row labelled with the pattern that matched it
+        found = 0
+        for position, pattern in enumerate(patterns):
+            results, total = self.find(pattern, limit, offset)
+            found += len(results)
+            if output_format == 'table':
+                print(f"Results for '{pattern}':", file=out)
+            if results:
+                self.render(results, output_format, out, header=position == 0, query=pattern)
+            elif output_format == 'table':
+                print(f"No components or IPs found with '{pattern}'.", file=out)
+            if offset + len(results) < total:
+                print(f"'{pattern}': showing {len(results)} of {total} matches, raise --limit for more.",
+                      file=self.status_stream(output_format, out))
+        return found
+
+    def query(self, partial_value, limit=None, offset=0, after=None):
+        # JSON-encoded answer for the HTTP API, served from the result cache when the
+        # index has not changed since the same search was last made. With --fresh the
+        # index catches up first, so a cached answer is never older than the database
+        if self.fresh:
+            self.refresh()
+        key = (self.generation, partial_value, limit, offset, tuple(after) if after else None)
+        with self.cache_lock:
+            if key in self.result_cache:
+                self.result_cache.move_to_end(key)
+                self.metrics.count('search_cache', result='hit')
+                return self.result_cache[key]
+        self.metrics.count('search_cache', result='miss')
+        results, total = self.lookup(partial_value, limit, offset, after)
+        more = bool(limit) and len(results) == limit and (after is not None or offset + len(results) < total)
+        response = json.dumps({
+            'query': partial_value,
+            'total': total,
+            'rows': [dict(zip(FIELDS, row)) for row in results],
+            'next': list(results[-1]) if more else None,
+        }).encode('utf-8')
+        with self.cache_lock:
+            self.result_cache[key] = response
+            while len(self.result_cache) > self.cache_size:
+                self.result_cache.popitem(last=False)
+        return response
+
+    def render(self, rows, output_format, out, header=True, query=None, fields=FIELDS):
+        # With a query each row is labelled with it, for output covering several searches
+        labels = [] if query is None else [query]
+        if output_format == 'table':
             table = PrettyTable()
-            table.field_names = ["Region", "IP Address", "Component Name", "Platform", "Path"]
-            table.align["Region"] = "l"
-            table.align["IP Address"] = "l"
-            table.align["Component Name"] = "l"
-            table.align["Platform"] = "l"
-            table.align["Path"] = "l"
-            
-            for row in results:
+            table.field_names = ["Region", "IP Address", "Component Name", "Platform", "Path"] if fields is FIELDS else list(fields)
+            table.align = "l"
+            for row in rows:
                 table.add_row(row)
+            print(table, file=out)
+        elif output_format == 'tsv':
+            if header:
+                out.write('\t'.join((['query'] if labels else []) + list(fields)) + '\n')
+            for row in rows:
+                out.write('\t'.join(str(value if value is not None else '').replace('\t', ' ').replace('\n', ' ') for value in labels + list(row)) + '\n')
+        else:
+            for row in rows:
+                document = {'query': query} if labels else {}
+                document.update(zip(fields, row))
+                out.write(json.dumps(document, default=str) + '\n')
+        out.flush()
 
-            print(table)
+    def report(self, name, keys=(), output_format='table', out=sys.stdout):
+        # Prints a report from the rollup tables, for every key or only the given ones;
+        # it needs a database connection but no index
+        if self.connection is None:
+            self.connection = self.connect_database(**self.db_config)
+            self.connection.autocommit = True
+            self.cursor = self.connection.cursor()
+        fields, query, key_column = REPORTS[name]
+        if keys:
+            query += f" AND {key_column} IN ({', '.join(['%s'] * len(keys))})"
+        self.cursor.execute(query + f" ORDER BY {', '.join(str(position + 1) for position in range(len(fields) - 1))}", tuple(keys))
+        rows = self.cursor.fetchall()
+        if rows:
+            self.render(rows, output_format, out, fields=fields)
         else:
-            print(f"No components or IPs found with '{partial_value}'.")
+            print(f"Nothing to report for {name}{': ' + ', '.join(keys) if keys else ''}.", file=self.status_stream(output_format, out))
+        return len(rows)
 
     def close(self):
+        self.stopped.set()
+        if self.refresher:
+            self.refresher.join()
+        if self.fresh and self.loaded:
+            self.save_snapshot()
         if self.cursor:
             self.cursor.close()
         if self.connection:
             self.connection.close()
 
+def parse_after(value):
+    # The after parameter is the "next" row of a previous page: a JSON list with one
+    # string (or null) per field. Anything else would fail deep in the index
+    after = json.loads(value)
+    if not isinstance(after, list) or len(after) != len(FIELDS) or not all(item is None or isinstance(item, str) for item in after):
+        raise ValueError(f"after must be a list of {len(FIELDS)} strings or nulls, the next value of a previous page")
+    return after
+
+def parse_count(value, name):
+    # limit and offset: a negative one would slice a wrong page, or an empty one with no next
+    count = int(value)
+    if count < 0:
+        raise ValueError(f"{name} must not be negative")
+    return count
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    # GET /search?q=<search>[&q=<search>...][&limit=N][&offset=N][&after=<JSON row>]
+    # answers one search as {"query", "total", "rows", "next"}, several as {"results": [...]};
+    # "next" is the after value for the following page. GET /metrics reports search timings
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/metrics':
+            body = self.server.searcher.metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if url.path == '/health':
+            self.send_json(200, json.dumps({'rows': len(self.server.searcher.index), 'generation': self.server.searcher.generation}).encode('utf-8'))
+            return
+        if url.path != '/search':
+            self.send_json(404, b'{"error": "not found"}')
+            return
+        params = parse_qs(url.query, keep_blank_values=True)
+        try:
+            patterns = params['q']
+            limit = parse_count(params.get('limit', [self.server.default_limit])[0], 'limit')
+            offset = parse_count(params.get('offset', [0])[0], 'offset')
+            after = parse_after(params['after'][0]) if 'after' in params else None
+        except (KeyError, ValueError) as e:
+            self.send_json(400, json.dumps({'error': f"bad request: {e}"}).encode('utf-8'))
+            return
+        responses = [self.server.searcher.query(pattern, limit, offset, after) for pattern in patterns]
+        self.send_json(200, responses[0] if len(responses) == 1 else b'{"results": [' + b', '.join(responses) + b']}')
+
+    def send_json(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(searcher, address, default_limit=100):
+    # One searcher, and so one index and database connection, shared by every request thread
+    host, _, port = address.rpartition(':')
+    server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), SearchRequestHandler)
+    server.daemon_threads = True
+    server.searcher = searcher
+    server.default_limit = default_limit
+    print(f"Serving component searches on http://{server.server_address[0]}:{server.server_address[1]}/search", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
 if __name__ == "__main__":
-    # Define your MySQL database details
-    db_config = {
-        'user': 'directfn',
-        'password': 'mubasher',
-        'host': '172.20.162.55',
-        'database': 'COMPONENT_DB'
-    }
-
-    searcher = RemoteDatabaseSearcher(db_config)
+    parser = argparse.ArgumentParser(description="Search components by name, IP, CIDR or field.")
+    parser.add_argument('patterns', nargs='*', help="Searches to run without prompting ('-' reads one per line from stdin)")
+    parser.add_argument('--config', default='./config/config.yaml', help='Path to the YAML configuration file')
+    parser.add_argument('--snapshot', default=os.path.expanduser('~/.cache/component-inventory/components.snapshot'),
+                        help='Local snapshot of the components table')
+    parser.add_argument('--refresh-interval', type=int, default=60, help='Seconds between background snapshot refreshes')
+    freshness = parser.add_mutually_exclusive_group()
+    freshness.add_argument('--stale-ok', dest='fresh', action='store_false', help='Answer from the snapshot, refreshing in the background (default)')
+    freshness.add_argument('--fresh', dest='fresh', action='store_true', help='Catch up with the database before every search')
+    # Both actions share dest, and argparse would take the default from the first, store_false
+    parser.set_defaults(fresh=False)
+    parser.add_argument('--limit', type=int, default=100, help='Rows per page (0 shows every match at once)')
+    parser.add_argument('--offset', type=int, default=0, help='Matches skipped before the first page')
+    parser.add_argument('--format', dest='output_format', choices=['table', 'tsv', 'ndjson'], default='table',
+                        help='table, or tab-separated / JSON lines without table layout for piping')
+    parser.add_argument('--serve', metavar='[HOST:]PORT', help='Answer searches over HTTP/JSON instead of prompting')
+    parser.add_argument('--cache-size', type=int, default=1024, help='Search responses kept by the HTTP result cache')
+    parser.add_argument('--report', choices=sorted(REPORTS),
+                        help='Print host counts per component, platform or region, or first/last seen per host; patterns select exact names')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as file:
+        db_config = yaml.safe_load(file)['db_config']
+
+    patterns = []
+    for pattern in args.patterns:
+        if pattern == '-':
+            patterns.extend(line.strip() for line in sys.stdin if line.strip())
+        else:
+            patterns.append(pattern)
+
+    searcher = RemoteDatabaseSearcher(db_config, args.snapshot, args.refresh_interval, args.fresh, args.cache_size)
+
+    if args.report:
+        searcher.report(args.report, patterns, args.output_format)
+        searcher.close()
+        sys.exit(0)
+
+    if args.serve:
+        searcher.connect()
+        serve(searcher, args.serve, args.limit)
+        searcher.close()
+        sys.exit(0)
+
+    if args.patterns:
+        # A one-off run catches up with the database once rather than refreshing in the background
+        searcher.connect(background=False)
+        if not args.fresh and searcher.refresh():
+            searcher.save_snapshot()
+        searcher.search_many(patterns, args.limit, args.offset, args.output_format)
+        searcher.close()
+        sys.exit(0)
+
     searcher.connect()
     
+    last_search, next_after = None, None
     while True:
-        value_part = input("Enter part of the component name or IP to search (or type 'exit' to quit): ")
+        # Paging is a ':'-prefixed command, so every other input, 'n' included, stays a search
+        value_part = input("Enter a search (name or IP part, prefix*, CIDR, field:value), ':n' for the next page or 'exit' to quit: ")
         if value_part.lower() == 'exit':
             print("Exiting the search loop.")
             break
-        searcher.search_by_name_or_ip(value_part)
+        if value_part.strip().lower() == ':n':
+            if next_after is None:
+                print("No more pages.")
+                continue
+            next_after = searcher.search_by_name_or_ip(last_search, args.limit, after=next_after, output_format=args.output_format)
+            continue
+        last_search = value_part
+        next_after = searcher.search_by_name_or_ip(value_part, args.limit, args.offset, output_format=args.output_format)
     
     searcher.close()
@@ -0,0 +1,168 @@
+from loguru import logger
+
+class ComponentWriter:
+    def __init__(self, db_pool, ip, region, catalog, connection=None, host_id=None):
+        # With a connection the writer joins the caller's open transaction, and the caller
+        # commits or rolls it back; otherwise it takes one from db_pool for its own
+        self.db_pool = db_pool
+        self.ip = ip
+        self.region = region
+        self.catalog = catalog
+        self.host_id = host_id
+        self.connection = connection
+        self.owns_connection = connection is None
+        self.cursor = None
+        self.seen = set()
+        self.row_count = 0
+        self.previous = {}
+        self.written = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Anything not committed by now is rolled back
+        self.discard()
+        return False
+
+    def begin(self):
+        # The old rows are deleted inside the same transaction as the new inserts, so
+        # readers keep seeing the previous component set until commit
+        if self.cursor is None:
+            if self.host_id is None:
+                self.host_id = self.catalog.host_id(self.ip, self.region)
+            if self.connection is None:
+                self.connection = self.db_pool.acquire()
+            self.cursor = self.connection.cursor()
+            # Locking the host's row first serializes writers of the same host, so each reads
+            # the set the previous one committed; a locking read of host_components alone
+            # would only take gap locks for a host with no components yet, and those do not
+            # exclude each other
+            self.cursor.execute("SELECT host_id FROM hosts WHERE host_id = %s FOR UPDATE", (self.host_id,))
+            self.cursor.fetchall()
+            # The set being replaced, to apply only the difference to the rollups at commit
+            self.cursor.execute(
+                "SELECT hc.component_id, cc.platform_id FROM host_components hc "
+                "JOIN component_catalog cc ON cc.component_id = hc.component_id WHERE hc.host_id = %s",
+                (self.host_id,)
+            )
+            self.previous = dict(self.cursor.fetchall())
+            self.cursor.execute("DELETE FROM host_components WHERE host_id = %s", (self.host_id,))
+
+    def write(self, components):
+        # Keep one row per component name, as the old per-row duplicate check did
+        unique = []
+        for component in components:
+            if component['comp_name'] in self.seen:
+                logger.info(f"Skipping duplicate entry for IP {self.ip}, component {component['comp_name']}, and region {self.region}.")
+                continue
+            self.seen.add(component['comp_name'])
+            unique.append(component)
+        if not unique:
+            return
+        component_ids = self.catalog.component_ids([(component['comp_name'], component['platform']) for component in unique])
+        self.begin()
+        rows = [
+            (self.host_id, component_ids[(component['comp_name'], component['platform'])], component['path'], component.get('version'))
+            for component in unique
+        ]
+        self.cursor.executemany(
+            "INSERT INTO host_components (host_id, component_id, comp_path, version) VALUES (%s, %s, %s, %s)",
+            rows
+        )
+        self.row_count += len(rows)
+        for component in unique:
+            component_id = component_ids[(component['comp_name'], component['platform'])]
+            self.written[component_id] = self.catalog.platforms[component['platform']]
+
+    def adjust_counts(self, table, key_column, deltas):
+        # Applies +1/-1 host counts per (key, region); the row is created first if missing.
+        # Keys are sorted, so concurrent commits lock rows in the same order
+        if not deltas:
+            return
+        deltas = sorted(deltas.items())
+        self.cursor.executemany(
+            f"INSERT IGNORE INTO {table} ({key_column}, region, host_count) VALUES (%s, %s, 0)",
+            [(key, self.region) for key, _ in deltas]
+        )
+        self.cursor.executemany(
+            f"UPDATE {table} SET host_count = host_count + %s WHERE {key_column} = %s AND region = %s",
+            [(delta, key, self.region) for key, delta in deltas]
+        )
+
+    def update_rollups(self):
+        # Keeps the report tables in step with host_components from the difference between
+        # the replaced and the new component set, inside the same transaction. It runs at
+        # commit, so the shared rollup rows stay locked only while the transaction ends
+        previous, written = self.previous, self.written
+        component_deltas = {component_id: 1 for component_id in written.keys() - previous.keys()}
+        component_deltas.update((component_id, -1) for component_id in previous.keys() - written.keys())
+        previous_platforms, written_platforms = set(previous.values()), set(written.values())
+        platform_deltas = {platform_id: 1 for platform_id in written_platforms - previous_platforms}
+        platform_deltas.update((platform_id, -1) for platform_id in previous_platforms - written_platforms)
+
+        self.adjust_counts('component_region_counts', 'component_id', component_deltas)
+        self.adjust_counts('platform_region_counts', 'platform_id', platform_deltas)
+        host_delta = int(bool(written)) - int(bool(previous))
+        if host_delta or len(written) != len(previous):
+            self.cursor.execute("INSERT IGNORE INTO region_counts (region, host_count, component_count) VALUES (%s, 0, 0)", (self.region,))
+            self.cursor.execute(
+                "UPDATE region_counts SET host_count = host_count + %s, component_count = component_count + %s WHERE region = %s",
+                (host_delta, len(written) - len(previous), self.region)
+            )
+        if written:
+            self.cursor.execute(
+                "UPDATE hosts SET first_seen = COALESCE(first_seen, NOW()), last_seen = NOW(), component_count = %s WHERE host_id = %s",
+                (len(written), self.host_id)
+            )
+        else:
+            self.cursor.execute("UPDATE hosts SET component_count = 0 WHERE host_id = %s", (self.host_id,))
+
+    def commit(self, scan_token=None):
+        self.begin()
+        # Stored with the rows it describes, so the token never runs ahead of the table, and
+        # last_updated_time moves so snapshot readers know the host's components changed;
+        # like every timestamp the fetchers compare, it comes from the database clock
+        self.cursor.execute(
+            "UPDATE servers SET scan_token = %s, last_updated_time = NOW(), update_status = %s, error_message = NULL WHERE server_ip = %s",
+            (scan_token, 'Success', self.ip)
+        )
+        self.update_rollups()
+        if self.owns_connection:
+            self.connection.commit()
+        logger.info(f"Replaced components for IP {self.ip} in region {self.region} with {self.row_count} rows.")
+        self.close()
+
+    def remove(self):
+        # Deletes all of the host's components and takes them out of the rollups, for a
+        # host that is gone; its hosts row keeps first_seen and last_seen. The scan token
+        # describes content only, so it goes too: a new instance reusing the IP with the
+        # same directories would otherwise be reported unchanged and never written
+        self.begin()
+        self.cursor.execute("UPDATE servers SET scan_token = NULL WHERE server_ip = %s", (self.ip,))
+        self.update_rollups()
+        if self.owns_connection:
+            self.connection.commit()
+        logger.info(f"Removed {len(self.previous)} components of IP {self.ip} in region {self.region}.")
+        self.close()
+
+    def discard(self):
+        if self.cursor is None:
+            return
+        try:
+            if self.owns_connection:
+                self.connection.rollback()
+        except Exception as e:
+            logger.error(f"Failed to roll back component writes for IP {self.ip}: {e}")
+        finally:
+            self.close()
+
+    def close(self):
+        try:
+            self.cursor.close()
+        except Exception:
+            pass
+        self.cursor = None
+        if self.owns_connection:
+            self.db_pool.release(self.connection)
+            self.connection = None
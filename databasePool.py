@@ -0,0 +1,70 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+import mysql.connector
+from loguru import logger
+
+class DatabasePool:
+    def __init__(self, db_config, size=5, connect=None):
+        self.db_config = db_config
+        self.size = max(1, int(size))
+        self.connect = connect or mysql.connector.connect
+
+        # Connections are opened lazily and reused; the semaphore makes callers
+        # wait for a free connection instead of failing when the pool is busy
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(self.size)
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def acquire(self):
+        self.slots.acquire()
+        try:
+            try:
+                connection = self.idle.get_nowait()
+                if not connection.is_connected():
+                    connection.reconnect()
+            except queue.Empty:
+                connection = self.connect(**self.db_config)
+                with self.lock:
+                    self.connections.append(connection)
+            return connection
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, connection):
+        self.idle.put(connection)
+        self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    @contextmanager
+    def transaction(self):
+        # Yields a cursor; everything executed on it is committed together or rolled back
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def close(self):
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception as e:
+                logger.error(f"Failed to close pooled database connection: {e}")
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+# Upper bounds in seconds of the stage duration histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+
+# Latest durations kept per stage for the summary's percentiles
+SAMPLE_WINDOW = 4096
+
+class MetricsRegistry:
+    def __init__(self, prefix='component_inventory'):
+        # Durations per stage and region go into histograms, and only the latest
+        # SAMPLE_WINDOW per stage are kept as samples. Nothing is labelled by host, so
+        # memory and series stay bounded however many hosts or requests are timed
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.histograms = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+        self.sums = defaultdict(float)
+        self.errors = defaultdict(int)
+        self.maxima = defaultdict(float)
+        self.samples = defaultdict(lambda: deque(maxlen=SAMPLE_WINDOW))
+        self.counters = defaultdict(int)
+
+    def observe(self, stage, seconds, region=None, error=False):
+        key = (stage, region or '')
+        with self.lock:
+            self.histograms[key][bisect_left(BUCKETS, seconds)] += 1
+            self.sums[key] += seconds
+            self.errors[key] += int(error)
+            self.maxima[stage] = max(self.maxima[stage], seconds)
+            self.samples[stage].append(seconds)
+
+    @contextmanager
+    def time(self, stage, region=None):
+        # Times the block as one observation of the stage; an exception counts as an error
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, region, error)
+
+    def count(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def format_labels(self, labels):
+        labels = [(name, value) for name, value in labels if value not in (None, '')]
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+    def render(self):
+        # Prometheus text exposition format
+        name = f"{self.prefix}_stage_duration_seconds"
+        lines = [f"# HELP {name} Time spent per stage.", f"# TYPE {name} histogram"]
+        with self.lock:
+            for (stage, region), buckets in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS + ('+Inf',), buckets):
+                    cumulative += bucket_count
+                    labels = self.format_labels([('stage', stage), ('region', region), ('le', bound)])
+                    lines.append(f"{name}_bucket{labels} {cumulative}")
+                labels = self.format_labels([('stage', stage), ('region', region)])
+                lines.append(f"{name}_sum{labels} {self.sums[(stage, region)]:.6f}")
+                lines.append(f"{name}_count{labels} {cumulative}")
+
+            errors_name = f"{self.prefix}_stage_errors_total"
+            lines.append(f"# HELP {errors_name} Stage runs that ended in an error.")
+            lines.append(f"# TYPE {errors_name} counter")
+            for (stage, region), errors in sorted(self.errors.items()):
+                lines.append(f"{errors_name}{self.format_labels([('stage', stage), ('region', region)])} {errors}")
+
+            for counter in sorted({counter for counter, _ in self.counters}):
+                lines.append(f"# TYPE {self.prefix}_{counter}_total counter")
+            for (counter, labels), value in sorted(self.counters.items()):
+                lines.append(f"{self.prefix}_{counter}_total{self.format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        # For node_exporter's textfile collector, which must never see a half-written file
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as metrics_file:
+            metrics_file.write(self.render())
+        os.replace(temp_path, path)
+
+    def summary(self):
+        # Per stage: observations, total and max seconds, p50 and p95 over the latest
+        # SAMPLE_WINDOW observations; plus every counter
+        stages = {}
+        with self.lock:
+            for stage, samples in self.samples.items():
+                ordered = sorted(samples)
+                keys = [key for key in self.histograms if key[0] == stage]
+                stages[stage] = {
+                    'count': sum(sum(self.histograms[key]) for key in keys),
+                    'total_seconds': round(sum(self.sums[key] for key in keys), 3),
+                    'p50_seconds': round(ordered[int(0.5 * (len(ordered) - 1))], 4),
+                    'p95_seconds': round(ordered[int(0.95 * (len(ordered) - 1))], 4),
+                    'max_seconds': round(self.maxima[stage], 4),
+                }
+            counters = [dict(labels, name=counter, value=value) for (counter, labels), value in sorted(self.counters.items())]
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'elapsed_seconds': round(time.time() - self.started, 3),
+            'stages': stages,
+            'counters': counters,
+        }
+
+    def write_summary(self, directory, name='run'):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{name}_summary_{time.strftime('%Y%m%d%H%M%S', time.localtime(self.started))}.json")
+        with open(path, 'w') as summary_file:
+            json.dump(self.summary(), summary_file, indent=2)
+        return path
+
+    def serve(self, port, host='127.0.0.1'):
+        # Serves /metrics from a daemon thread for as long as the process runs
+        registry = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, int(port)), MetricsRequestHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+        return server
@@ -0,0 +1,2 @@
+-- Token of the last component scan, sent back to the detector for incremental runs
+ALTER TABLE servers ADD COLUMN scan_token VARCHAR(64) NULL;
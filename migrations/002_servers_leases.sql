@@ -0,0 +1,4 @@
+-- Lease on a server held by a sharded fetcher while it scans it; an expired lease is free to claim again
+ALTER TABLE servers ADD COLUMN lease_owner VARCHAR(128) NULL;
+ALTER TABLE servers ADD COLUMN lease_expires DATETIME NULL;
+CREATE INDEX servers_lease_expires ON servers (lease_expires);
@@ -0,0 +1,4 @@
+-- Recent scan time behind each host's adaptive timeout, and the circuit breaker that parks failing hosts
+ALTER TABLE servers ADD COLUMN scan_seconds FLOAT NULL;
+ALTER TABLE servers ADD COLUMN consecutive_failures INT NOT NULL DEFAULT 0;
+ALTER TABLE servers ADD COLUMN parked_until DATETIME NULL;
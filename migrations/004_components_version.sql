@@ -0,0 +1,2 @@
+-- Component version, filled in when the fetcher runs the detector with --versions
+ALTER TABLE components ADD COLUMN version VARCHAR(128) NULL;
@@ -0,0 +1,65 @@
+-- Normalized component storage: integer keys into small platform, catalog and host
+-- tables instead of repeated strings on every row. Apply with normalize_components.py,
+-- which also reports table sizes and query timings before and after. Names are compared
+-- byte for byte (utf8mb4_0900_bin): under the default case-insensitive collation 'Solr'
+-- and 'solr' would share one catalog row, and ComponentCatalog, which looks ids up by the
+-- spelling a host reported, would not find the second.
+-- MySQL commits every CREATE and RENAME on its own, so this cannot run as one transaction.
+-- Every statement can be run again instead: after a failure, rerunning the migration picks
+-- up where it stopped (normalize_components.py skips the rename once it is done).
+
+-- The old table is kept for a rollback; components is recreated below as a view of the same columns
+RENAME TABLE components TO components_legacy;
+
+CREATE TABLE IF NOT EXISTS platforms (
+    platform_id SMALLINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(32) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_bin NOT NULL,
+    UNIQUE KEY platforms_name (name)
+);
+CREATE TABLE IF NOT EXISTS component_catalog (
+    component_id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    component_name VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_bin NOT NULL,
+    platform_id SMALLINT UNSIGNED NOT NULL,
+    UNIQUE KEY component_catalog_name (component_name, platform_id)
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    host_id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    ip VARCHAR(45) NOT NULL,
+    region VARCHAR(64) NOT NULL,
+    UNIQUE KEY hosts_ip_region (ip, region)
+);
+CREATE TABLE IF NOT EXISTS host_components (
+    host_id INT UNSIGNED NOT NULL,
+    component_id INT UNSIGNED NOT NULL,
+    comp_path VARCHAR(1024),
+    version VARCHAR(128) NULL,
+    PRIMARY KEY (host_id, component_id),
+    KEY host_components_component (component_id)
+);
+
+-- Every copy skips rows already copied. Legacy rows without a platform are kept under the
+-- 'Unknown' platform; rows without an ip or region cannot be keyed and are left behind,
+-- which normalize_components.py reports
+INSERT IGNORE INTO platforms (name)
+    SELECT DISTINCT CONVERT(COALESCE(platform, 'Unknown') USING utf8mb4) COLLATE utf8mb4_0900_bin FROM components_legacy;
+INSERT IGNORE INTO component_catalog (component_name, platform_id)
+    SELECT DISTINCT CONVERT(c.component_name USING utf8mb4) COLLATE utf8mb4_0900_bin, p.platform_id
+    FROM components_legacy c
+    JOIN platforms p ON p.name = CONVERT(COALESCE(c.platform, 'Unknown') USING utf8mb4) COLLATE utf8mb4_0900_bin
+    WHERE c.component_name IS NOT NULL;
+INSERT IGNORE INTO hosts (ip, region)
+    SELECT DISTINCT ip, region FROM components_legacy WHERE ip IS NOT NULL AND region IS NOT NULL;
+INSERT IGNORE INTO host_components (host_id, component_id, comp_path, version)
+    SELECT h.host_id, cc.component_id, c.comp_path, c.version
+    FROM components_legacy c
+    JOIN hosts h ON h.ip = c.ip AND h.region = c.region
+    JOIN platforms p ON p.name = CONVERT(COALESCE(c.platform, 'Unknown') USING utf8mb4) COLLATE utf8mb4_0900_bin
+    JOIN component_catalog cc
+        ON cc.component_name = CONVERT(c.component_name USING utf8mb4) COLLATE utf8mb4_0900_bin AND cc.platform_id = p.platform_id;
+
+CREATE OR REPLACE VIEW components AS
+    SELECT h.ip, h.region, cc.component_name, p.name AS platform, hc.comp_path, hc.version
+    FROM host_components hc
+    JOIN hosts h ON h.host_id = hc.host_id
+    JOIN component_catalog cc ON cc.component_id = hc.component_id
+    JOIN platforms p ON p.platform_id = cc.platform_id;
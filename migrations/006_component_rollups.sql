@@ -0,0 +1,45 @@
+-- Report tables kept current by ComponentWriter in each host's write transaction, filled
+-- here once from host_components; apply while no fetcher is writing
+CREATE TABLE component_region_counts (
+    component_id INT UNSIGNED NOT NULL,
+    region VARCHAR(64) NOT NULL,
+    host_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (component_id, region)
+);
+CREATE TABLE platform_region_counts (
+    platform_id SMALLINT UNSIGNED NOT NULL,
+    region VARCHAR(64) NOT NULL,
+    host_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (platform_id, region)
+);
+CREATE TABLE region_counts (
+    region VARCHAR(64) NOT NULL PRIMARY KEY,
+    host_count INT NOT NULL DEFAULT 0,
+    component_count INT NOT NULL DEFAULT 0
+);
+ALTER TABLE hosts
+    ADD COLUMN first_seen DATETIME NULL,
+    ADD COLUMN last_seen DATETIME NULL,
+    ADD COLUMN component_count INT NOT NULL DEFAULT 0;
+
+INSERT INTO component_region_counts (component_id, region, host_count)
+    SELECT hc.component_id, h.region, COUNT(*)
+    FROM host_components hc JOIN hosts h ON h.host_id = hc.host_id
+    GROUP BY hc.component_id, h.region;
+INSERT INTO platform_region_counts (platform_id, region, host_count)
+    SELECT cc.platform_id, h.region, COUNT(DISTINCT hc.host_id)
+    FROM host_components hc
+    JOIN hosts h ON h.host_id = hc.host_id
+    JOIN component_catalog cc ON cc.component_id = hc.component_id
+    GROUP BY cc.platform_id, h.region;
+INSERT INTO region_counts (region, host_count, component_count)
+    SELECT h.region, COUNT(DISTINCT hc.host_id), COUNT(*)
+    FROM host_components hc JOIN hosts h ON h.host_id = hc.host_id
+    GROUP BY h.region;
+UPDATE hosts h
+    JOIN (SELECT host_id, COUNT(*) AS components FROM host_components GROUP BY host_id) c ON c.host_id = h.host_id
+    SET h.component_count = c.components;
+UPDATE hosts h
+    JOIN servers s ON s.server_ip = h.ip
+    SET h.first_seen = s.last_updated_time, h.last_seen = s.last_updated_time
+    WHERE h.component_count > 0;
@@ -0,0 +1,9 @@
+-- The sweep sharded fetchers share: started_at is taken from the database clock by the
+-- first node of a sweep and used by every node that joins it, finished_at is set once
+-- a node finds nothing left to claim
+CREATE TABLE fetcher_sweeps (
+    sweep_id TINYINT UNSIGNED NOT NULL PRIMARY KEY,
+    started_at DATETIME NULL,
+    finished_at DATETIME NULL
+);
+INSERT INTO fetcher_sweeps (sweep_id) VALUES (1);
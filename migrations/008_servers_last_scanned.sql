@@ -0,0 +1,5 @@
+-- When the fetcher last scanned each host, whatever the outcome. Discovery writes
+-- last_updated_time too, for every host it probes, so that column cannot tell a
+-- scanned host from one just added; a host never scanned has no last_scanned_time
+ALTER TABLE servers ADD COLUMN last_scanned_time DATETIME NULL;
+CREATE INDEX servers_last_scanned_time ON servers (last_scanned_time);
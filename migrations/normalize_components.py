@@ -0,0 +1,118 @@
+import os
+import sys
+import time
+import argparse
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from databasePool import DatabasePool
+
+MIGRATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), '005_normalized_components.sql')
+RENAMED = 'components_legacy'
+NORMALIZED_TABLES = ['platforms', 'component_catalog', 'hosts', 'host_components']
+
+# The searcher's full load, one host's refresh and a per-component count, in each layout
+LEGACY_QUERIES = [
+    ('full read', "SELECT region, ip, component_name, platform, comp_path FROM {table}", False),
+    ('one host', "SELECT region, ip, component_name, platform, comp_path FROM {table} WHERE ip = %s", True),
+    ('count per component', "SELECT component_name, COUNT(*) FROM {table} GROUP BY component_name", False),
+]
+NORMALIZED_QUERIES = [
+    ('full read', "SELECT host_id, component_id, comp_path FROM host_components", False),
+    ('one host', "SELECT host_id, component_id, comp_path FROM host_components WHERE host_id IN (SELECT host_id FROM hosts WHERE ip = %s)", True),
+    ('count per component', "SELECT component_id, COUNT(*) FROM host_components GROUP BY component_id", False),
+]
+
+def statements(path):
+    # The migration's statements, split on the semicolons ending its lines
+    with open(path, 'r') as migration:
+        lines = [line for line in migration if not line.lstrip().startswith('--')]
+    return [statement.strip() for statement in ''.join(lines).split(';\n') if statement.strip().rstrip(';')]
+
+def table_type(cursor, table):
+    # 'BASE TABLE', 'VIEW', or None when the table does not exist
+    cursor.execute(
+        "SELECT table_type FROM information_schema.TABLES WHERE table_schema = DATABASE() AND table_name = %s",
+        (table,)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def table_sizes(cursor, tables):
+    for table in tables:
+        cursor.execute(f"ANALYZE TABLE {table}")
+        cursor.fetchall()
+    placeholders = ', '.join(['%s'] * len(tables))
+    cursor.execute(
+        "SELECT table_name, table_rows, data_length, index_length FROM information_schema.TABLES "
+        f"WHERE table_schema = DATABASE() AND table_name IN ({placeholders})",
+        tuple(tables)
+    )
+    return cursor.fetchall()
+
+def report(label, cursor, tables, queries, sample_ip):
+    print(f"{label}:")
+    total = 0
+    for table, rows, data_length, index_length in table_sizes(cursor, tables):
+        total += data_length + index_length
+        print(f"    {table:<20} {rows:>10} rows   data {data_length / 1048576:8.2f} MiB   index {index_length / 1048576:8.2f} MiB")
+    print(f"    {'total':<20} {total / 1048576:36.2f} MiB")
+    for name, query, per_host in queries:
+        start = time.perf_counter()
+        cursor.execute(query, (sample_ip,) if per_host else ())
+        rows = cursor.fetchall()
+        print(f"    {name:<20} {len(rows):>10} rows   {(time.perf_counter() - start) * 1000:10.1f} ms")
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Move the components table into the normalized catalog layout.")
+    parser.add_argument('--config', default='./config/config.yaml', help='Path to the YAML configuration file')
+    parser.add_argument('--apply', action='store_true', help='Run the migration; without it only the current layout is reported')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as file:
+        config = yaml.safe_load(file)
+    db_pool = DatabasePool(config['db_config'], size=1)
+    try:
+        with db_pool.transaction() as cursor:
+            # A rerun after a failure finds the legacy rows already renamed
+            renamed = table_type(cursor, RENAMED) is not None
+            if renamed and table_type(cursor, 'components') == 'BASE TABLE':
+                sys.exit(f"Both components and {RENAMED} are tables; move one of them aside before migrating")
+            legacy = RENAMED if renamed else 'components'
+            cursor.execute(f"SELECT ip FROM {legacy} LIMIT 1")
+            row = cursor.fetchone()
+            sample_ip = row[0] if row else ''
+            queries = [(name, query.format(table=legacy), per_host) for name, query, per_host in LEGACY_QUERIES]
+            before = report('before', cursor, [legacy], queries, sample_ip)
+        if not args.apply:
+            return
+
+        # MySQL commits each CREATE and RENAME on its own, so the migration is not atomic;
+        # its statements are written to be run again instead, apart from the rename, which
+        # is skipped once done
+        start = time.perf_counter()
+        with db_pool.transaction() as cursor:
+            for statement in statements(MIGRATION):
+                if renamed and statement.startswith('RENAME TABLE'):
+                    continue
+                cursor.execute(statement)
+        print(f"migrated in {time.perf_counter() - start:.1f} s")
+
+        with db_pool.transaction() as cursor:
+            after = report('after', cursor, NORMALIZED_TABLES, NORMALIZED_QUERIES, sample_ip)
+            # Rows without an ip, region or component name have no key in the new layout
+            cursor.execute(f"SELECT COUNT(*) FROM {RENAMED}")
+            legacy_rows = cursor.fetchone()[0]
+            cursor.execute("SELECT COUNT(*) FROM host_components")
+            copied = cursor.fetchone()[0]
+        print(f"copied {copied} of {legacy_rows} legacy rows, {legacy_rows - copied} skipped")
+        if before:
+            print(f"size after / before: {after / before:.1%}")
+    finally:
+        db_pool.close()
+
+if __name__ == "__main__":
+    main()
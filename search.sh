@@ -2,4 +2,4 @@
 DIR="$( cd -P "$( dirname "$0" )" && pwd )"
 cd $DIR
 
-.venv/bin/python componentSearcher.py
\ No newline at end of file
+.venv/bin/python componentSearcher.py "$@"
\ No newline at end of file
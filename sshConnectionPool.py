@@ -0,0 +1,171 @@
+import socket
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import paramiko
+from loguru import logger
+
+class SSHConnectionPool:
+    def __init__(self, connect_timeout=10, max_idle=512, idle_ttl=300):
+        self.connect_timeout = connect_timeout
+        self.max_idle = max_idle
+        self.idle_ttl = idle_ttl
+
+        # One authenticated client per (ip, user, key_path); channels for commands and
+        # SFTP are opened on its transport instead of a new handshake each time. Idle clients
+        # map to the time they were released and are closed after idle_ttl seconds unused
+        self.clients = {}
+        self.in_use = Counter()
+        self.idle = OrderedDict()
+        self.known_users = {}
+        self.handshakes = Counter()
+        self.lock = threading.Lock()
+        self.host_locks = defaultdict(threading.Lock)
+
+    def is_active(self, client):
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def handshake(self, ip, user, key_path):
+        ssh_client = paramiko.SSHClient()
+        ssh_client.load_system_host_keys()
+        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh_client.connect(
+            hostname=ip, username=user, key_filename=key_path,
+            timeout=self.connect_timeout, banner_timeout=self.connect_timeout, auth_timeout=self.connect_timeout
+        )
+        with self.lock:
+            self.handshakes[ip] += 1
+        return ssh_client
+
+    def port_open(self, ip, port=22):
+        # A plain TCP connect is far cheaper than an SSH handshake timing out per user
+        try:
+            with socket.create_connection((ip, port), timeout=self.connect_timeout):
+                return True
+        except OSError:
+            return False
+
+    def check_out(self, ip, user, key_path, ssh_client):
+        key = (ip, user, key_path)
+        with self.lock:
+            self.clients[key] = ssh_client
+            self.known_users[ip] = user
+            self.in_use[key] += 1
+            self.idle.pop(key, None)
+        return ssh_client
+
+    def acquire(self, ip, user, key_path):
+        # Returns a connected client, reusing a live one for the same key; raises on failure
+        key = (ip, user, key_path)
+        self.close_expired()
+        with self.lock:
+            host_lock = self.host_locks[ip]
+        with host_lock:
+            with self.lock:
+                ssh_client = self.clients.get(key)
+            if ssh_client is not None and not self.is_active(ssh_client):
+                self.discard(key)
+                ssh_client = None
+            if ssh_client is None:
+                ssh_client = self.handshake(ip, user, key_path)
+            return self.check_out(ip, user, key_path, ssh_client)
+
+    def acquire_any(self, ip, users, key_path, preferred_user=None):
+        # Goes straight to the user known to work on this host; otherwise logs in with
+        # every candidate at once and keeps the first that succeeds
+        if not self.port_open(ip):
+            logger.warning(f"Port 22 unreachable on {ip}, skipping login attempts.")
+            return None, None
+
+        known_user = self.known_users.get(ip) or preferred_user
+        if known_user:
+            try:
+                return self.acquire(ip, known_user, key_path), known_user
+            except Exception as e:
+                logger.warning(f"Connection with known user {known_user} failed on {ip}: {e}")
+
+        candidates = [user for user in OrderedDict.fromkeys(users) if user and user != known_user]
+        if not candidates:
+            return None, None
+
+        executor = ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix='ssh-probe')
+        futures = {executor.submit(self.handshake, ip, user, key_path): user for user in candidates}
+        winner = None
+        try:
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.warning(f"Connection with {futures[future]} failed on {ip}: {e}")
+                    continue
+                winner = future
+                break
+        finally:
+            executor.shutdown(wait=False)
+
+        # Logins that succeed after the winner are closed as soon as they finish
+        for future in futures:
+            if future is not winner:
+                future.add_done_callback(self.close_unused)
+        if winner is None:
+            return None, None
+        user = futures[winner]
+        return self.check_out(ip, user, key_path, winner.result()), user
+
+    def close_unused(self, future):
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+
+    def release(self, ip, user, key_path):
+        # Returns the client to the pool; beyond max_idle the least recently used idle ones are closed
+        key = (ip, user, key_path)
+        evicted = []
+        with self.lock:
+            self.in_use[key] -= 1
+            if self.in_use[key] <= 0:
+                del self.in_use[key]
+                if key in self.clients:
+                    self.idle[key] = time.monotonic()
+            while len(self.idle) > self.max_idle:
+                oldest, _ = self.idle.popitem(last=False)
+                evicted.append(self.clients.pop(oldest, None))
+        for ssh_client in evicted:
+            if ssh_client is not None:
+                ssh_client.close()
+        self.close_expired()
+
+    def close_expired(self):
+        # Idle clients are kept in release order, so the expired ones are at the front
+        expired = []
+        cutoff = time.monotonic() - self.idle_ttl
+        with self.lock:
+            while self.idle and next(iter(self.idle.values())) < cutoff:
+                oldest, _ = self.idle.popitem(last=False)
+                expired.append(self.clients.pop(oldest, None))
+        for ssh_client in expired:
+            if ssh_client is not None:
+                ssh_client.close()
+
+    def discard(self, key):
+        with self.lock:
+            ssh_client = self.clients.pop(key, None)
+            self.idle.pop(key, None)
+        if ssh_client is not None:
+            ssh_client.close()
+
+    def close_host(self, ip):
+        # Closes every idle connection to the host once no tool needs it anymore
+        with self.lock:
+            keys = [key for key in self.clients if key[0] == ip and key not in self.in_use]
+        for key in keys:
+            self.discard(key)
+
+    def close(self):
+        with self.lock:
+            keys = list(self.clients)
+        for key in keys:
+            self.discard(key)
+        logger.info(f"SSH pool closed after {sum(self.handshakes.values())} handshakes to {len(self.handshakes)} hosts.")
@@ -0,0 +1,53 @@
+import os
+import sys
+import json
+import zlib
+import base64
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from componentDetector import ComponentDetector, COMPACT_PREFIX
+from componentFetcher import decode_compact
+
+COMPONENTS = [
+    {'comp_name': 'solr-indexer', 'platform': 'Java', 'path': '/apps/solr-indexer', 'version': '8.11.2'},
+    {'comp_name': 'libquote', 'platform': 'C++', 'path': '/apps/quotes/libquote', 'version': None},
+    {'comp_name': 'opa', 'platform': 'opa', 'path': '/opt/opa', 'version': '0.61.0'},
+]
+
+def response(components):
+    return {'status': 'success', 'message': '', 'token': 'a1b2', 'components': components}
+
+def payload(document):
+    return COMPACT_PREFIX + base64.b64encode(zlib.compress(json.dumps(document).encode('utf-8'))).decode('ascii')
+
+@pytest.mark.parametrize('versions', [True, False], ids=['versions', 'no-versions'])
+def test_round_trip(versions):
+    detector = ComponentDetector('/apps/', versions=versions)
+    components = COMPONENTS if versions else [{key: value for key, value in component.items() if key != 'version'} for component in COMPONENTS]
+
+    line = detector.encode_compact(response(components))
+
+    assert line.startswith(COMPACT_PREFIX) and '\n' not in line
+    assert decode_compact(line) == response(components)
+
+def test_round_trip_without_components():
+    line = ComponentDetector('/apps').encode_compact(dict(response([]), status='unchanged', message='No change'))
+    assert decode_compact(line) == dict(response([]), status='unchanged', message='No change')
+
+@pytest.mark.parametrize('line', [
+    pytest.param(ComponentDetector('/apps').encode_compact(response(COMPONENTS))[:-12], id='truncated'),
+    pytest.param(COMPACT_PREFIX + 'not base64!', id='not-base64'),
+    pytest.param(payload(['a', 'list']), id='not-an-object'),
+    pytest.param(payload({'status': 'success', 'message': '', 'token': None, 'base': '/apps/', 'platforms': ['Java'],
+                          'names': ['a', 'b'], 'codes': [0], 'paths': ['a', 'b']}), id='short-column'),
+    pytest.param(payload({'status': 'success', 'message': '', 'token': None, 'base': '/apps/', 'platforms': ['Java'],
+                          'names': ['a'], 'codes': [3], 'paths': ['a']}), id='unknown-platform-code'),
+    pytest.param(payload({'status': 'success', 'base': '/apps/', 'platforms': [], 'names': [], 'codes': [], 'paths': []}),
+                 id='missing-key'),
+])
+def test_malformed_payload_raises_value_error(line):
+    with pytest.raises(ValueError):
+        decode_compact(line)
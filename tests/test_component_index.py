@@ -0,0 +1,74 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from componentIndex import ComponentIndex
+
+ROWS = [
+    ('us-east-1', '10.0.1.5', 'solr-indexer', 'Java', '/apps/solr-indexer'),
+    ('us-east-1', '10.0.1.5', 'opa-gateway', 'opa', '/apps/opa-gateway'),
+    ('us-east-1', '10.0.2.7', 'solr-indexer', 'Java', '/apps/search/solr-indexer'),
+    ('us-east-1', '10.0.2.7', 'libquote', 'C++', '/apps/quotes/libquote'),
+    ('eu-west-1', '10.1.0.9', 'pricing', 'Java', '/apps/pricing'),
+    ('eu-west-1', '10.1.0.9', 'us-holidays', 'Java', '/apps/us-holidays'),
+]
+
+@pytest.fixture
+def index():
+    index = ComponentIndex()
+    index.add_rows(ROWS)
+    index.prepare()
+    return index
+
+def matched(index, query):
+    return [(row[1], row[2]) for row in index.search(query)]
+
+def test_bare_terms_match_name_or_ip_substrings(index):
+    assert matched(index, 'indexer') == [('10.0.1.5', 'solr-indexer'), ('10.0.2.7', 'solr-indexer')]
+    assert matched(index, '2.7') == [('10.0.2.7', 'libquote'), ('10.0.2.7', 'solr-indexer')]
+    # Bare terms never look at the path or the region
+    assert matched(index, 'quotes') == []
+    assert matched(index, 'eu-west') == []
+
+def test_field_aliases_and_exact_fields(index):
+    assert matched(index, 'path:quotes') == [('10.0.2.7', 'libquote')]
+    assert matched(index, 'component:opa') == [('10.0.1.5', 'opa-gateway')]
+    # Region and platform match whole values only, whatever the case
+    assert matched(index, 'region:us') == []
+    assert matched(index, 'platform:JAVA region:eu-west-1') == [('10.1.0.9', 'pricing'), ('10.1.0.9', 'us-holidays')]
+    # An unknown field is searched as a bare term, colon included
+    assert matched(index, 'owner:us') == []
+
+def test_prefix_and_cidr_terms(index):
+    assert matched(index, 'name:us*') == [('10.1.0.9', 'us-holidays')]
+    assert matched(index, 'ip:10.0.*') == [
+        ('10.0.1.5', 'opa-gateway'), ('10.0.1.5', 'solr-indexer'), ('10.0.2.7', 'libquote'), ('10.0.2.7', 'solr-indexer'),
+    ]
+    assert matched(index, '10.0.2.0/24') == [('10.0.2.7', 'libquote'), ('10.0.2.7', 'solr-indexer')]
+    assert matched(index, '10.0.0.0/16 solr') == [('10.0.1.5', 'solr-indexer'), ('10.0.2.7', 'solr-indexer')]
+
+def test_search_page_counts_every_match_and_honours_offset(index):
+    page, total = index.search_page('ip:10.*', 2, offset=1)
+    assert total == 6
+    assert page == index.search('ip:10.*')[1:3]
+
+@pytest.mark.parametrize('prepared', [True, False], ids=['ranked', 'stale-ranks'])
+def test_after_resumes_past_a_replaced_host(index, prepared):
+    first_page, _ = index.search_page('', 3)
+    assert [row[1] for row in first_page] == ['10.1.0.9', '10.1.0.9', '10.0.1.5']
+
+    # 10.0.1.5 is rescanned with a renamed component, 10.0.2.7 loses one
+    index.replace_hosts(['10.0.1.5', '10.0.2.7'], [
+        ('us-east-1', '10.0.1.5', 'opa-gateway', 'opa', '/apps/opa-gateway'),
+        ('us-east-1', '10.0.1.5', 'solr-replica', 'Java', '/apps/solr-replica'),
+        ('us-east-1', '10.0.2.7', 'solr-indexer', 'Java', '/apps/search/solr-indexer'),
+    ])
+    if prepared:
+        index.prepare()
+
+    rest, total = index.search_page('', 10, after=first_page[-1])
+    assert total == 5
+    assert [(row[1], row[2]) for row in rest] == [('10.0.1.5', 'solr-replica'), ('10.0.2.7', 'solr-indexer')]
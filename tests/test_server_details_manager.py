@@ -0,0 +1,104 @@
+import os
+import sys
+from unittest import mock
+
+import boto3
+import botocore.session
+import pytest
+import yaml
+from botocore.stub import Stubber
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ServerDetailsManager import ServerDetailsManager
+
+LISTED_STATES = {'Name': 'instance-state-name', 'Values': ['pending', 'running', 'stopping', 'stopped']}
+
+def instance(ip, state='running', **tags):
+    # EC2 leaves out the private address of an instance without one, and Tags when there are none
+    described = {'State': {'Code': 16, 'Name': state}}
+    if ip:
+        described['PrivateIpAddress'] = ip
+    if tags:
+        described['Tags'] = [{'Key': key, 'Value': value} for key, value in tags.items()]
+    return described
+
+def page(instances, next_token=None):
+    response = {'Reservations': [{'ReservationId': 'r-0', 'Instances': instances}]}
+    if next_token:
+        response['NextToken'] = next_token
+    return response
+
+def request(next_token=None):
+    params = {'Filters': [LISTED_STATES], 'MaxResults': 1000}
+    if next_token:
+        params['NextToken'] = next_token
+    return params
+
+@pytest.fixture
+def manager(tmp_path):
+    config = {
+        'aws': {'regions': {'us-east-1': {'key_path': 'east.pem'}, 'eu-west-1': {'key_path': 'west.pem'}}},
+        'datacenters': {},
+        'db_config': {},
+    }
+    config_file = tmp_path / 'config.yaml'
+    config_file.write_text(yaml.safe_dump(config))
+    manager = ServerDetailsManager(str(config_file), str(tmp_path), connect=lambda **_: mock.MagicMock())
+    yield manager
+    manager.close()
+
+@pytest.fixture
+def ec2_clients():
+    # One stubbed EC2 client per region, handed out in place of the real ones
+    clients = {}
+
+    def client(self, service_name, region_name=None, **kwargs):
+        if region_name not in clients:
+            clients[region_name] = botocore.session.get_session().create_client(
+                service_name, region_name=region_name, aws_access_key_id='testing', aws_secret_access_key='testing'
+            )
+            clients[region_name].stubber = Stubber(clients[region_name])
+        return clients[region_name]
+
+    with mock.patch.object(boto3.session.Session, 'client', client):
+        yield lambda region: client(None, 'ec2', region_name=region).stubber
+
+def test_get_region_servers_follows_every_page(manager, ec2_clients):
+    stubber = ec2_clients('us-east-1')
+    stubber.add_response('describe_instances', page([instance('10.0.0.1', Name='web-1')], 'token-2'), request())
+    stubber.add_response('describe_instances', page([instance('10.0.0.2', state='stopped', Name='web-2')]), request('token-2'))
+
+    with stubber:
+        servers = manager.get_region_servers('us-east-1', {'key_path': 'east.pem'})
+        stubber.assert_no_pending_responses()
+
+    assert servers == [
+        {'ip': '10.0.0.1', 'region': 'us-east-1', 'key_path': 'east.pem', 'running_state': 'running', 'server_name': 'web-1'},
+        {'ip': '10.0.0.2', 'region': 'us-east-1', 'key_path': 'east.pem', 'running_state': 'stopped', 'server_name': 'web-2'},
+    ]
+
+def test_get_region_servers_drops_tradeops_and_instances_without_ip(manager, ec2_clients):
+    stubber = ec2_clients('us-east-1')
+    stubber.add_response('describe_instances', page([
+        instance('10.0.0.1', Name='kept', Team='Platform'),
+        instance('10.0.0.2', Name='excluded', Team='TradeOps'),
+        instance(None, Name='no-ip'),
+        instance('10.0.0.3'),
+    ]), request())
+
+    with stubber:
+        servers = manager.get_region_servers('us-east-1', {'key_path': 'east.pem'})
+
+    assert [(server['ip'], server['server_name']) for server in servers] == [('10.0.0.1', 'kept'), ('10.0.0.3', None)]
+
+def test_get_all_servers_records_a_failed_region(manager, ec2_clients):
+    east, west = ec2_clients('us-east-1'), ec2_clients('eu-west-1')
+    east.add_response('describe_instances', page([instance('10.0.0.1', Name='web-1')]), request())
+    west.add_client_error('describe_instances', service_error_code='UnauthorizedOperation', http_status_code=403)
+
+    with east, west:
+        servers = manager.get_all_servers()
+
+    assert [server['ip'] for server in servers] == ['10.0.0.1']
+    assert manager.failed_regions == {'eu-west-1'}